@@ -1,7 +1,6 @@
 import tkinter as tk
 import csv
 import os
-import matplotlib.pyplot as plt
 from tkinter import messagebox, Toplevel, Listbox
 
 # File to store categories and expenses data
@@ -107,6 +106,7 @@ def show_recent_expenses():
 
 # Plot expenses bar chart with labels and heading
 def plot_expenses():
+    import matplotlib.pyplot as plt
     categories = list(data.keys())
     expenses = [data[category]['expenses'] for category in categories]
     
@@ -0,0 +1,132 @@
+import datetime
+
+# Periods the aggregate cache keeps sums for
+PERIODS = ('day', 'week', 'month')
+
+
+# Key of the day, ISO week or month a timestamp falls in
+def period_key(period, timestamp):
+    return date_period_key(period, datetime.date.fromtimestamp(timestamp))
+
+
+# Key of the day, ISO week or month a date falls in
+def date_period_key(period, date):
+    if period == 'day':
+        return date.toordinal()
+    if period == 'week':
+        year, week, _ = date.isocalendar()
+        return year, week
+    return date.year, date.month
+
+
+# Period keys for a timestamp, cached per 15 minutes (every UTC offset is a multiple of that,
+# so the local date never changes inside one slot)
+_period_keys_cache = {}
+
+
+def period_keys(timestamp):
+    slot = int(timestamp // 900)
+    keys = _period_keys_cache.get(slot)
+    if keys is None:
+        date = datetime.date.fromtimestamp(slot * 900)
+        keys = _period_keys_cache[slot] = tuple(date_period_key(period, date) for period in PERIODS)
+    return keys
+
+
+# Sum, count, min and max of a group of expenses, in cents
+class Stats:
+    __slots__ = ('total', 'count', 'minimum', 'maximum')
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, amount):
+        self.total += amount
+        self.count += 1
+        if self.minimum is None or amount < self.minimum:
+            self.minimum = amount
+        if self.maximum is None or amount > self.maximum:
+            self.maximum = amount
+
+    # Add a group of amounts at once
+    def add_all(self, total, count, minimum, maximum):
+        self.total += total
+        self.count += count
+        if self.minimum is None or minimum < self.minimum:
+            self.minimum = minimum
+        if self.maximum is None or maximum > self.maximum:
+            self.maximum = maximum
+
+
+# Aggregate cache updated incrementally as expenses are added
+class ExpenseAggregates:
+    def __init__(self):
+        self.categories = {}
+        self.periods = {period: {} for period in PERIODS}
+        self.descriptions = {}
+
+    # Fold one expense record into every aggregate
+    def add(self, record):
+        category = record.category
+        amount = record.amount
+        self._stats(self.categories, category).add(amount)
+        descriptions = self.descriptions.get(category)
+        if descriptions is None:
+            descriptions = self.descriptions[category] = {}
+        self._stats(descriptions, record.description).add(amount)
+        if record.timestamp is not None:
+            for period, key in zip(PERIODS, period_keys(record.timestamp)):
+                self._stats(self.periods[period], (category, key)).add(amount)
+
+    # Fold many records in (a loaded batch or an import). Records sharing category, description
+    # and timestamp are summed first, so each aggregate is updated once per group.
+    def add_many(self, records):
+        groups = {}
+        for record in records:
+            key = (record.category, record.description, record.timestamp)
+            amounts = groups.get(key)
+            if amounts is None:
+                groups[key] = [record.amount]
+            else:
+                amounts.append(record.amount)
+        for (category, description, timestamp), amounts in groups.items():
+            group = (sum(amounts), len(amounts), min(amounts), max(amounts))
+            self._stats(self.categories, category).add_all(*group)
+            descriptions = self.descriptions.get(category)
+            if descriptions is None:
+                descriptions = self.descriptions[category] = {}
+            self._stats(descriptions, description).add_all(*group)
+            if timestamp is not None:
+                for period, key in zip(PERIODS, period_keys(timestamp)):
+                    self._stats(self.periods[period], (category, key)).add_all(*group)
+
+    @staticmethod
+    def _stats(table, key):
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = Stats()
+        return stats
+
+    # Stats for a category (all time)
+    def category(self, category):
+        return self.categories.get(category) or Stats()
+
+    # Stats for a category in the period containing timestamp ('day', 'week' or 'month')
+    def period(self, category, period, timestamp):
+        return self.periods[period].get((category, period_key(period, timestamp))) or Stats()
+
+    # Amount spent in a category during the current month
+    def spent_this_month(self, category, now=None):
+        now = datetime.datetime.now().timestamp() if now is None else now
+        return self.period(category, 'month', now).total
+
+    # Budget left for a category after all of its expenses
+    def remaining_budget(self, category, budget):
+        return budget - self.category(category).total
+
+    # Stats per description within a category, as {description: Stats}
+    def descriptions_for(self, category):
+        return self.descriptions.get(category, {})
@@ -0,0 +1,268 @@
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Repository root, so the app modules can be imported
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import storage
+from ledger import ExpenseLedger
+from records import ExpenseRecord, apply_operation, current_month, month_bounds
+
+# Synthetic ledger sizes as (expenses, categories); bigger ones (up to 10M expenses and 50k
+# categories) can be given with --sizes, e.g. --sizes 10000000x50000
+DEFAULT_SIZES = ((1000, 10), (100000, 500), (1000000, 5000))
+
+# A path slower than its baseline by more than this factor counts as a regression
+DEFAULT_THRESHOLD = 1.5
+
+# Paths faster than this (seconds) are too noisy to compare against a baseline
+MIN_COMPARED_SECONDS = 0.01
+
+# Version of the results layout and measurements; baselines with another version are not compared.
+# Bump it whenever a path starts measuring something different.
+# 2: plot_detailed_expenses draws the default top-categories chart; every category is plot_detailed_expenses/all
+RESULTS_FORMAT = 2
+
+# Where results are written by default, one JSON file per commit
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# Expenses are spread over this many months up to the current one
+HISTORY_MONTHS = 24
+
+# Shops and items the synthetic descriptions are made of
+SHOPS = ('Market', 'Cafe', 'Garage', 'Pharmacy', 'Books', 'Hardware', 'Cinema', 'Bakery', 'Transit', 'Florist')
+ITEMS = ('lunch', 'coffee', 'fuel', 'tickets', 'supplies', 'groceries', 'repair', 'gift', 'snacks', 'rent')
+
+
+# Storage operations for a synthetic ledger: categories first, then expenses in time order
+def synthetic_operations(expenses, categories, seed=0):
+    generator = random.Random(seed)
+    names = [f"CC-{index:05d}" for index in range(categories)]
+    operations = [('category', (name, generator.randrange(100, 100000) * 100)) for name in names]
+    end = month_bounds(current_month())[1]
+    start = end - HISTORY_MONTHS * 30 * 86400
+    step = (end - start) / max(expenses, 1)
+    descriptions = [f"{shop} {item}" for shop in SHOPS for item in ITEMS]
+    for index in range(expenses):
+        operations.append(('expense', (ExpenseRecord(
+            generator.randrange(100, 20000), generator.choice(descriptions), start + index * step,
+            names[int(generator.paretovariate(1.2)) % categories]),)))
+    return operations
+
+
+# Median seconds over runs of function(), and the peak traced memory (MB) of one more run.
+# With setup, every run calls function(setup()) and only function is timed (and traced).
+def measure(function, runs, memory, setup=None):
+    times = []
+    for _ in range(runs + memory):
+        args = () if setup is None else (setup(),)
+        if len(times) == runs:
+            tracemalloc.start()
+            function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            break
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    result = {'seconds': statistics.median(times), 'runs': runs}
+    if memory:
+        result['peak_mb'] = peak / 2 ** 20
+    return result
+
+
+# Check that saving twice and then syncing leaves the stored rows alone: a backend must not
+# report its own writes as another instance's changes and merge them in again
+def check_save_round_trip(data, expenses):
+    storage.save_data(copy.deepcopy(data))
+    saved = copy.deepcopy(data)
+    storage.save_data(saved)
+    changes = storage.sync_changes()
+    stored = sum(len(values['details']) for values in storage.load_data().values())
+    held = sum(len(values['details']) for values in saved.values())
+    if changes or stored != expenses or held != expenses:
+        raise AssertionError(f"{storage.STORAGE_BACKEND}: {expenses} expenses saved twice, "
+                             f"{stored} stored, {held} held, {len(changes)} change(s) synced back")
+
+
+# Tk root for the widget paths, or None without a display
+def tk_root():
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception:
+        return None
+    root.withdraw()
+    return root
+
+
+# Time every hot path for one ledger size; returns {path name: result}
+def bench_size(expenses, categories, backends, runs, memory, root):
+    results = {}
+    operations = synthetic_operations(expenses, categories)
+    data = {}
+    for kind, args in operations:
+        apply_operation(data, kind, args)
+    ledger = ExpenseLedger(sink=lambda operations: None)
+    ledger.apply_operations(operations)
+    ledger.search_index.prepare()
+    ledger.category_index.merge()
+
+    for backend in backends:
+        storage.set_backend(backend)
+        with tempfile.TemporaryDirectory() as folder:
+            previous = os.getcwd()
+            os.chdir(folder)
+            try:
+                # Every save run gets its own copy: save_data merges into the dict it is given
+                results[f'save_data/{backend}'] = measure(
+                    storage.save_data, runs, memory, setup=lambda: copy.deepcopy(data))
+                # The load and totals paths below must see exactly the requested ledger
+                check_save_round_trip(data, expenses)
+                results[f'load_data/{backend}'] = measure(storage.load_data, runs, memory)
+                results[f'load_data_month/{backend}'] = measure(
+                    lambda: storage.load_data(current_month()), runs, memory)
+                results[f'category_totals/{backend}'] = measure(storage.category_totals, runs, memory)
+                storage.wait_for_compaction()
+            finally:
+                os.chdir(previous)
+
+    # What refresh_categories() leads to: the selectors look categories up as they are typed
+    results['category_lookup'] = measure(
+        lambda: [ledger.find_categories(prefix, 200) for prefix in ('', 'cc-0', 'cc-01', 'cc-012')], runs, memory)
+
+    if root is not None:
+        from widgets import VirtualTreeview, CategorySelector
+        import tkinter as tk
+        tree = VirtualTreeview(root, columns=('Category', 'Description', 'Amount'), height=5)
+
+        # refresh_recent_expenses(): hand every expense to the treeview and draw the visible rows
+        def refresh_recent_expenses():
+            tree.set_rows(ledger.expenses())
+            root.update_idletasks()
+        results['refresh_recent_expenses'] = measure(refresh_recent_expenses, runs, memory)
+
+        selector = CategorySelector(root, tk.StringVar(root), ledger.find_categories)
+
+        def refresh_categories():
+            selector.update_suggestions()
+            root.update_idletasks()
+            selector.hide()
+        results['refresh_categories'] = measure(refresh_categories, runs, memory)
+        tree.destroy()
+        selector.destroy()
+
+    # plot_detailed_expenses() in the chart window's default (top categories) mode, rendered to an
+    # off-screen Agg canvas as the chart's render thread does
+    import plotting
+
+    def plot():
+        plotting.plot_detailed_expenses(ledger.data, ledger.aggregates).canvas.draw()
+    results['plot_detailed_expenses'] = measure(plot, runs, memory)
+
+    # The same with every category on its own bar, the heaviest mode
+    def plot_all():
+        plotting.plot_detailed_expenses(ledger.data, ledger.aggregates, plotting.ALL).canvas.draw()
+    results['plot_detailed_expenses/all'] = measure(plot_all, runs, memory)
+    return results
+
+
+# Current commit, so results can be told apart
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+# Paths slower than baseline by more than threshold, as (key, seconds, baseline seconds)
+def regressions(results, baseline, threshold):
+    slower = []
+    for size, paths in results['sizes'].items():
+        for path, result in paths.items():
+            before = baseline.get('sizes', {}).get(size, {}).get(path)
+            if before is None or before['seconds'] < MIN_COMPARED_SECONDS:
+                continue
+            if result['seconds'] > before['seconds'] * threshold:
+                slower.append((f"{size} {path}", result['seconds'], before['seconds']))
+    return slower
+
+
+# "100000x500" -> (100000, 500)
+def parse_size(text):
+    expenses, _, categories = text.lower().partition('x')
+    return int(expenses), int(categories or 10)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the load/save/refresh/plot hot paths on synthetic ledgers.")
+    parser.add_argument('--sizes', nargs='+', type=parse_size,
+                        help="ledger sizes as EXPENSESxCATEGORIES (default: 1000x10 100000x500 1000000x5000)")
+    parser.add_argument('--backends', nargs='+', default=list(storage.BACKENDS), choices=list(storage.BACKENDS))
+    parser.add_argument('--runs', type=int, default=3, help="timed runs per path (the median is kept)")
+    parser.add_argument('--no-memory', action='store_true', help="skip the extra tracemalloc run per path")
+    parser.add_argument('--output', help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown factor that counts as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    commit = git_commit()
+    root = tk_root()
+    results = {
+        'format': RESULTS_FORMAT,
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'display': root is not None,
+        'sizes': {},
+    }
+    for expenses, categories in args.sizes or DEFAULT_SIZES:
+        size = f"{expenses}x{categories}"
+        print(f"{size}:")
+        paths = bench_size(expenses, categories, args.backends, args.runs, not args.no_memory, root)
+        results['sizes'][size] = paths
+        for path, result in paths.items():
+            memory = f"  peak {result['peak_mb']:8.1f} MB" if 'peak_mb' in result else ''
+            print(f"  {path:<28} {result['seconds'] * 1000:10.1f} ms{memory}")
+    if root is None:
+        print("No display: refresh_recent_expenses and refresh_categories were skipped")
+    else:
+        root.destroy()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get('format') != RESULTS_FORMAT:
+            print(f"{args.baseline} was recorded by another version of this benchmark; "
+                  f"record a new baseline")
+            return 2
+        slower = regressions(results, baseline, args.threshold)
+        for key, seconds, before in slower:
+            print(f"REGRESSION {key}: {seconds * 1000:.1f} ms (was {before * 1000:.1f} ms)")
+        if slower:
+            return 1
+        print(f"No regressions against {args.baseline} (threshold {args.threshold}x)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import os
+import statistics
+import subprocess
+import sys
+
+# Repository root, so the snippets can import the app modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What main.py does before the window appears: Tk, the app modules and loading the current month
+STARTUP = """
+import time
+start = time.perf_counter()
+import tkinter as tk
+from tkinter import messagebox, ttk
+import records, widgets, storage
+data = storage.load_data(records.current_month())
+if os.environ.get('DISPLAY'):
+    root = tk.Tk()
+    root.update()
+elapsed = time.perf_counter() - start
+print(elapsed, 'matplotlib' in sys.modules)
+"""
+
+# What the first click on "Plot Detailed Expenses" (or the background pre-warm) pays
+PLOTTING = """
+import time
+start = time.perf_counter()
+import plotting
+elapsed = time.perf_counter() - start
+print(elapsed, True)
+"""
+
+
+# Run a snippet in a fresh interpreter, so imports are measured cold
+def run_snippet(snippet):
+    code = "import os, sys\nsys.path.insert(0, %r)\n%s" % (ROOT, snippet)
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    elapsed, imported_matplotlib = output.split()
+    return float(elapsed), imported_matplotlib == 'True'
+
+
+# Median time over several fresh runs
+def measure(snippet, runs):
+    times = []
+    imported_matplotlib = False
+    for _ in range(runs):
+        elapsed, imported_matplotlib = run_snippet(snippet)
+        times.append(elapsed)
+    return statistics.median(times), imported_matplotlib
+
+
+def main(runs=5):
+    startup, startup_matplotlib = measure(STARTUP, runs)
+    plotting, _ = measure(PLOTTING, runs)
+    print(f"Startup (Tk + load_data): {startup * 1000:.1f} ms")
+    print(f"Plotting module import:   {plotting * 1000:.1f} ms")
+    if startup_matplotlib:
+        print("matplotlib was imported on the startup path")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Chart data kept for the most recent (ledger version, period, mode) keys; the shared
+# summary and a chart per mode looked at since the last change
+CHART_DATA_CACHE_SIZE = 8
+
+# Rendered images kept in memory (an RGBA image of a 1000x650 window is about 2.6 MB)
+IMAGE_CACHE_SIZE = 16
+
+# Folder of the on-disk PNG cache, chosen with the EXPENSE_TRACKER_CHART_CACHE environment
+# variable; without it rendered images are only kept in memory
+DISK_CACHE_FOLDER = os.environ.get('EXPENSE_TRACKER_CHART_CACHE') or None
+
+# Most PNG files kept in the disk cache; the least recently used are removed first
+DISK_CACHE_FILES = 200
+
+
+# Least recently used mapping holding at most capacity entries
+class _LRU:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Caches for the chart at two levels:
+#   chart data     keyed by (ledger version, period, mode), so the totals, segments and labels
+#                  are only worked out again after the ledger changed
+#   images         rendered RGBA images keyed by (chart digest, width, height), in memory and
+#                  optionally as PNG files in folder. The digest covers everything drawn (the
+#                  category set, the period's totals and the chart type), so files written by an
+#                  earlier run are reused when the data is the same.
+# Chart data is used from the Tk thread and images from the render thread.
+class ChartCache:
+    def __init__(self, folder=DISK_CACHE_FOLDER, images=IMAGE_CACHE_SIZE, chart_data=CHART_DATA_CACHE_SIZE):
+        self.folder = folder
+        self._charts = _LRU(chart_data)
+        self._images = _LRU(images)
+        self._lock = threading.Lock()
+        # Lookups answered from memory, from disk, and not at all, for diagnostics
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # Chart data for key, from build() when it is not cached
+    def chart(self, key, build):
+        chart = self._charts.get(key)
+        if chart is None:
+            chart = build()
+            self._charts.put(key, chart)
+        return chart
+
+    # Rendered image (an (height, width, 4) uint8 array) for key, or None
+    def image(self, key):
+        with self._lock:
+            image = self._images.get(key)
+        if image is not None:
+            self.hits += 1
+            return image
+        image = self._read(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        with self._lock:
+            self._images.put(key, image)
+        return image
+
+    def store(self, key, image):
+        with self._lock:
+            self._images.put(key, image)
+        self._write(key, image)
+
+    def _path(self, key):
+        return os.path.join(self.folder, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.png')
+
+    def _read(self, key):
+        if self.folder is None:
+            return None
+        path = self._path(key)
+        try:
+            from PIL import Image
+            import numpy as np
+            with Image.open(path) as png:
+                image = np.asarray(png.convert('RGBA'))
+            os.utime(path)
+        except (ImportError, OSError):
+            return None
+        return image
+
+    # Write the PNG through a temporary file, so a reader never sees half of it
+    def _write(self, key, image):
+        if self.folder is None:
+            return
+        try:
+            from PIL import Image
+        except ImportError:
+            return
+        path = self._path(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            Image.fromarray(image, 'RGBA').save(temporary, 'PNG')
+            os.replace(temporary, path)
+            self._prune()
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+
+    # Remove the least recently used files beyond DISK_CACHE_FILES
+    def _prune(self):
+        with os.scandir(self.folder) as entries:
+            files = [(entry.stat().st_mtime, entry.path) for entry in entries if entry.name.endswith('.png')]
+        if len(files) > DISK_CACHE_FILES:
+            files.sort()
+            for _, path in files[:len(files) - DISK_CACHE_FILES]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,140 @@
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from records import ExpenseRecord
+
+# Columnar binary layout for a batch of expense rows (a month partition):
+#   header    MAGIC, then row count, string count and string table size (HEADER)
+#   columns   amount in cents int64, timestamp float64 (NaN when unknown), seq int64,
+#             category string id int32, description string id int32
+#   strings   string count + 1 end offsets (uint64) into a UTF-8 blob; every category and
+#             description is stored once however many rows use it
+# Numbers are little-endian and every column starts on an 8-byte boundary, so a reader maps
+# the file and views each column in place, and processes reading the same file share its pages.
+MAGIC = b'EXPCOL02'
+HEADER = struct.Struct('<8sQQQ')
+
+# Columns as (name, array typecode), in file order
+COLUMNS = (('amounts', 'q'), ('timestamps', 'd'), ('seqs', 'q'), ('categories', 'i'), ('descriptions', 'i'))
+
+
+def _padding(size):
+    return -size % 8
+
+
+# Write (seq, record) rows to path in the columnar layout
+def write_columns(path, rows):
+    strings = {}
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    for seq, record in rows:
+        columns['amounts'].append(record.amount)
+        columns['timestamps'].append(math.nan if record.timestamp is None else record.timestamp)
+        columns['seqs'].append(seq)
+        columns['categories'].append(strings.setdefault(record.category, len(strings)))
+        columns['descriptions'].append(strings.setdefault(record.description, len(strings)))
+    blob = bytearray()
+    offsets = array('Q', [0])
+    for text in strings:
+        blob += text.encode('utf-8')
+        offsets.append(len(blob))
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(columns['amounts']), len(strings), len(blob)))
+        for name, _ in COLUMNS:
+            data = _little_endian(columns[name]).tobytes()
+            file.write(data + bytes(_padding(len(data))))
+        file.write(_little_endian(offsets).tobytes())
+        file.write(bytes(blob))
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+# A columnar file opened read-only through mmap. Columns are memoryviews over the mapping;
+# strings are decoded on first use and then shared by every row that refers to them.
+class ColumnarFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            self._map = mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) if size else None
+        if self._map is None or self._map[:8] != MAGIC:
+            raise ValueError(f"{path} is not a columnar expense file")
+        view = memoryview(self._map)
+        _, self.rows, string_count, blob_size = HEADER.unpack_from(self._map)
+        offset = HEADER.size
+        self.offsets = {}
+        self._views = [view]
+        for name, typecode in COLUMNS:
+            width = array(typecode).itemsize * self.rows
+            self.offsets[name] = offset
+            column = view[offset:offset + width].cast(typecode)
+            self._views.append(column)
+            if sys.byteorder != 'little':
+                # Big-endian machines read a swapped copy instead of the mapping itself
+                column = _little_endian(array(typecode, column))
+            setattr(self, name, column)
+            offset += width + _padding(width)
+        self._string_ends = view[offset:offset + 8 * (string_count + 1)].cast('Q')
+        self._views.append(self._string_ends)
+        if sys.byteorder != 'little':
+            self._string_ends = _little_endian(array('Q', self._string_ends))
+        self._blob = offset + 8 * (string_count + 1)
+        self._strings = [None] * string_count
+
+    def __len__(self):
+        return self.rows
+
+    def string(self, index):
+        text = self._strings[index]
+        if text is None:
+            start = self._blob + self._string_ends[index]
+            end = self._blob + self._string_ends[index + 1]
+            text = self._strings[index] = self._map[start:end].decode('utf-8')
+        return text
+
+    # Yield (seq, 'expense', (record,)) for every row, like the CSV snapshot readers
+    def entries(self):
+        string = self.string
+        for amount, timestamp, seq, category, description in zip(
+                self.amounts, self.timestamps, self.seqs, self.categories, self.descriptions):
+            yield seq, 'expense', (ExpenseRecord(amount, string(description),
+                                                 None if timestamp != timestamp else timestamp,
+                                                 string(category)),)
+
+    # {category: total cents}, summed with NumPy straight from the mapped pages when it is installed.
+    # bincount adds in float64, which is exact for whole cents up to 2**53 (about $90 trillion).
+    def category_totals(self):
+        try:
+            import numpy
+        except ImportError:
+            totals = {}
+            for amount, category in zip(self.amounts, self.categories):
+                totals[category] = totals.get(category, 0) + amount
+        else:
+            amounts = numpy.asarray(self.amounts, dtype=numpy.int64)
+            categories = numpy.frombuffer(self._map, dtype='<i4', count=self.rows,
+                                          offset=self.offsets['categories'])
+            sums = numpy.bincount(categories, weights=amounts)
+            totals = {index: int(sums[index]) for index in numpy.flatnonzero(numpy.bincount(categories))}
+        return {self.string(index): total for index, total in totals.items()}
+
+    def close(self):
+        if self._map is not None:
+            for view in reversed(self._views):
+                view.release()
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,496 @@
+import csv
+import glob
+import io
+import os
+import shutil
+import threading
+import uuid
+from itertools import chain
+
+from columnar import ColumnarFile, write_columns
+from locking import FileLock
+from records import (ExpenseRecord, apply_operation, parse_legacy_detail, parse_timestamp, format_timestamp,
+                     to_cents, format_cents, month_of, month_bounds, format_month, parse_month)
+
+# File to store categories and expenses data (the compacted snapshot)
+CSV_FILE = 'categories_expenses.csv'
+
+# Append-only journal of changes made since the last snapshot
+JOURNAL_FILE = 'categories_expenses.journal'
+
+# Number of journal records that triggers a background compaction
+COMPACT_THRESHOLD = 1000
+
+# Marker row written at the top of the snapshot: format version, the last journal sequence
+# it contains, and a generation id that changes whenever save_data() replaces everything
+SNAPSHOT_MARKER = '#snapshot'
+SNAPSHOT_VERSION = 4
+
+# Dated expenses live in one partition file per month. The snapshot lists them
+# in "partition,<YYYY-MM>,<file name>" rows right after its marker row; each partition file starts
+# with a "#partition,<version>,<YYYY-MM>" row. A rewritten partition gets a new file name, so the
+# snapshot replace is the single point where a compaction takes effect.
+PARTITION_ROW = 'partition'
+PARTITION_MARKER = '#partition'
+
+# Layout for newly written partitions: 'csv', or 'columnar' for binary files (see columnar.py) that
+# load through mmap. Chosen with the EXPENSE_TRACKER_PARTITIONS environment variable; partitions in
+# the other layout are still read, and are converted when their month is next rewritten.
+PARTITION_FORMAT = os.environ.get('EXPENSE_TRACKER_PARTITIONS', 'csv')
+COLUMNAR_SUFFIX = '.col'
+
+# Header row of a rewritten journal, holding a random id so other processes notice the rewrite
+JOURNAL_MARKER = '#journal'
+
+# Several processes may share the files: _journal_lock guards this process's threads,
+# the lock file guards the files, and the journal sequence number is the version stamp.
+_journal_lock = threading.Lock()
+_journal_seq = 0
+_journal_records = 0
+_journal_offset = 0
+_journal_identity = None
+_generation = ''
+_foreign_changes = []
+_partitions = {}
+_compaction_thread = None
+
+
+# Advisory lock shared with other processes using the same files
+def _file_lock():
+    return FileLock(CSV_FILE + '.lock')
+
+
+# Parse stored fields into a storage operation (amounts are stored as dollars, held as cents)
+def _parse_operation(kind, fields):
+    if kind == 'category':
+        category, budget = fields[:2]
+        return kind, (category, to_cents(budget))
+    category, description, expense, timestamp = fields[:4]
+    return kind, (ExpenseRecord(to_cents(expense), description, parse_timestamp(timestamp), category),)
+
+
+# Storage fields for an expense record
+def _expense_fields(record):
+    return [record.category, record.description, format_cents(record.amount), format_timestamp(record.timestamp)]
+
+
+# Storage fields for an operation, as (kind, fields)
+def _operation_fields(kind, args):
+    if kind == 'expense':
+        return kind, _expense_fields(*args)
+    category, budget = args
+    return kind, [category, format_cents(budget)]
+
+
+# Read the snapshot header as (journal seq, generation, {month: partition file name})
+def _snapshot_index():
+    partitions = {}
+    if not os.path.exists(CSV_FILE):
+        return 0, '', partitions
+    with open(CSV_FILE, mode='r', newline='') as file:
+        reader = csv.reader(file)
+        row = next(reader, None)
+        if not row or row[0] != SNAPSHOT_MARKER:
+            # Legacy layout, without a header or partitions
+            return 0, '', partitions
+        seq, generation = int(row[2]), row[3] if len(row) > 3 else ''
+        for row in reader:
+            if not row or row[0] != PARTITION_ROW:
+                break
+            partitions[parse_month(row[1])] = row[2]
+    return seq, generation, partitions
+
+
+# Path of a partition file, which sits next to the snapshot
+def _partition_path(name):
+    return os.path.join(os.path.dirname(CSV_FILE), name)
+
+
+# Open a partition file for reading, as a text file or a ColumnarFile
+def _open_partition(name):
+    if name.endswith(COLUMNAR_SUFFIX):
+        return ColumnarFile(_partition_path(name))
+    return open(_partition_path(name), mode='r', newline='')
+
+
+# Open the snapshot and the partitions for the given months (all of them when months is None)
+# for reading; call with both locks held, so a compaction cannot remove them first
+def _open_snapshot(partitions, months=None):
+    files = []
+    try:
+        files.append(open(CSV_FILE, mode='r', newline=''))
+    except FileNotFoundError:
+        pass
+    for month in sorted(partitions) if months is None else months:
+        if month in partitions:
+            files.append(_open_partition(partitions[month]))
+    return files
+
+
+# Yield (seq, kind, args) for every row of open snapshot and partition files, one row at a time;
+# legacy "description: amount" rows have seq 0
+def _snapshot_entries(files):
+    for file in files:
+        with file:
+            if isinstance(file, ColumnarFile):
+                yield from file.entries()
+                continue
+            reader = csv.reader(file)
+            tagged = False
+            for row in reader:
+                if not row or row[0] == PARTITION_ROW:
+                    continue
+                if row[0] in (SNAPSHOT_MARKER, PARTITION_MARKER):
+                    tagged = True
+                    continue
+                if tagged:
+                    # Tagged rows, the same shape as journal records, ending with their seq
+                    yield (int(row[-1]),) + _parse_operation(row[0], row[1:])
+                else:
+                    # Legacy layout: one row per category with "description: amount" details
+                    category, budget, expenses, *expense_details = row
+                    yield 0, 'category', (category, to_cents(budget))
+                    for detail in expense_details:
+                        yield 0, 'expense', (parse_legacy_detail(category, detail),)
+
+
+# Read complete journal rows from a byte offset, as ([(seq, kind, args)], new offset)
+def _read_journal(offset):
+    if not os.path.exists(JOURNAL_FILE):
+        return [], 0
+    with open(JOURNAL_FILE, mode='rb') as file:
+        file.seek(offset)
+        chunk = file.read()
+    # A torn final line from a crash (or a writer mid-append) is left for later
+    end = chunk.rfind(b'\n') + 1
+    entries = []
+    for row in csv.reader(io.StringIO(chunk[:end].decode('utf-8'), newline='')):
+        if len(row) >= 3:
+            seq, kind, *fields = row
+            entries.append((int(seq),) + _parse_operation(kind, fields))
+    return entries, offset + end
+
+
+# Identity of the journal file, read from the header row written whenever it is rewritten
+def _current_journal_identity():
+    try:
+        with open(JOURNAL_FILE, mode='r', newline='') as file:
+            row = next(csv.reader(file), None)
+    except FileNotFoundError:
+        return None
+    return row[1] if row and row[0] == JOURNAL_MARKER else ''
+
+
+# Open what is on disk; call with both locks held. Returns the open snapshot files (with the
+# partitions for months, or all of them), the journal entries newer than the snapshot, and the
+# journal state as (last seq, records, offset, identity, generation, partitions)
+def _open_all(months=None):
+    snapshot_seq, generation, partitions = _snapshot_index()
+    files = _open_snapshot(partitions, months)
+    identity = _current_journal_identity()
+    entries, offset = _read_journal(0)
+    tail = [entry for entry in entries if entry[0] > snapshot_seq]
+    last_seq = max([snapshot_seq] + [seq for seq, _, _ in tail])
+    return files, tail, (last_seq, len(tail), offset, identity, generation, partitions)
+
+
+# Stream stored operations as (kind, args): the snapshot one row at a time, then the journal tail.
+# With a period (year, month) only that month's expenses are read, from its partition file;
+# every category is still included. The locks are only held while the files are opened.
+def stream_data(period=None):
+    global _journal_seq, _journal_records, _journal_offset, _journal_identity, _generation, _foreign_changes
+    global _partitions
+    with _journal_lock, _file_lock():
+        files, tail, state = _open_all(None if period is None else [period])
+        _journal_seq, _journal_records, _journal_offset, _journal_identity, _generation, _partitions = state
+        _foreign_changes = []
+    yield from _period_operations(chain(_snapshot_entries(files), tail), period)
+
+
+# (kind, args) for (seq, kind, args) entries, leaving out expenses outside period (if given)
+def _period_operations(entries, period):
+    start, end = month_bounds(period) if period is not None else (None, None)
+    for seq, kind, args in entries:
+        if kind == 'expense' and start is not None:
+            timestamp = args[0].timestamp
+            if timestamp is None or not start <= timestamp < end:
+                continue
+        yield kind, args
+
+
+# Stream stored operations like stream_data, without changing what this process has synced
+def read_operations(period=None):
+    with _journal_lock, _file_lock():
+        files, tail, _ = _open_all(None if period is None else [period])
+    yield from _period_operations(chain(_snapshot_entries(files), tail), period)
+
+
+# Expense records stored for one month, read without changing what this process has synced
+def read_expenses(period):
+    return [args[0] for kind, args in read_operations(period) if kind == 'expense']
+
+
+# Load data from the snapshot plus the journal tail (only one month's expenses if period is given)
+def load_data(period=None):
+    data = {}
+    for kind, args in stream_data(period):
+        apply_operation(data, kind, args)
+    return data
+
+
+# Months (year, month) that have expenses, oldest first
+def list_periods():
+    with _journal_lock, _file_lock():
+        snapshot_seq, generation, partitions = _snapshot_index()
+        months = set(partitions)
+        entries, _ = _read_journal(0)
+        for seq, kind, args in entries:
+            if kind == 'expense' and args[0].timestamp is not None:
+                months.add(month_of(args[0].timestamp))
+    return sorted(months)
+
+
+# Pick up records other processes wrote since we last looked; call with both locks held
+def _sync():
+    global _journal_seq, _journal_records, _journal_offset, _journal_identity, _generation, _partitions
+    known = _journal_seq
+    highest = known
+    identity = _current_journal_identity()
+    if identity != _journal_identity:
+        # Another process compacted or replaced the files
+        snapshot_seq, generation, partitions = _snapshot_index()
+        if generation != _generation:
+            _foreign_changes.append(('reload', ()))
+            _generation = generation
+        elif snapshot_seq > known:
+            # Only partitions that compaction rewrote can hold records we have not seen
+            changed = [month for month, name in partitions.items() if _partitions.get(month) != name]
+            _foreign_changes.extend((kind, args) for seq, kind, args
+                                    in _snapshot_entries(_open_snapshot(partitions, changed)) if seq > known)
+        _partitions = partitions
+        highest = max(highest, snapshot_seq)
+        _journal_identity = identity
+        _journal_offset = 0
+        _journal_records = 0
+    entries, _journal_offset = _read_journal(_journal_offset)
+    for seq, kind, args in entries:
+        if seq > known:
+            _foreign_changes.append((kind, args))
+            highest = max(highest, seq)
+    _journal_records += len(entries)
+    _journal_seq = highest
+
+
+# Hand over the changes other processes made since the last call
+def _take_foreign_changes():
+    global _foreign_changes
+    changes, _foreign_changes = _foreign_changes, []
+    return changes
+
+
+# Tagged CSV rows for (seq, kind, args) entries
+def _csv_rows(entries):
+    for seq, kind, args in entries:
+        kind, fields = _operation_fields(kind, args)
+        yield [kind, *fields, seq]
+
+
+# Write the snapshot from (seq, kind, args) entries for categories and undated expenses,
+# listing the partition files
+def _write_snapshot(category_rows, expense_rows, seq, generation, partitions):
+    tmp_file = CSV_FILE + '.tmp'
+    with open(tmp_file, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([SNAPSHOT_MARKER, SNAPSHOT_VERSION, seq, generation])
+        writer.writerows([PARTITION_ROW, format_month(month), partitions[month]] for month in sorted(partitions))
+        writer.writerows(_csv_rows(category_rows))
+        writer.writerows(_csv_rows(expense_rows))
+    os.replace(tmp_file, CSV_FILE)
+
+
+# Write a month's partition under a new file name in PARTITION_FORMAT: the current one's rows
+# (if any) with (seq, kind, args) expense entries added. A CSV partition is copied and appended
+# to; a columnar one is written out whole. Returns the new file name.
+def _write_partition(month, current, rows):
+    base = f"{os.path.splitext(os.path.basename(CSV_FILE))[0]}.{format_month(month)}.{uuid.uuid4().hex[:8]}"
+    if PARTITION_FORMAT == 'columnar':
+        name = base + COLUMNAR_SUFFIX
+        existing = _snapshot_entries([_open_partition(current)]) if current is not None else ()
+        write_columns(_partition_path(name), ((seq, args[0]) for seq, kind, args in chain(existing, rows)))
+        return name
+    name = base + '.csv'
+    path = _partition_path(name)
+    copy = current is not None and not current.endswith(COLUMNAR_SUFFIX)
+    if copy:
+        shutil.copyfile(_partition_path(current), path)
+    # A columnar partition going back to CSV has its rows written out again
+    existing = _snapshot_entries([_open_partition(current)]) if current is not None and not copy else ()
+    with open(path, mode='a', newline='') as file:
+        writer = csv.writer(file)
+        if not copy:
+            writer.writerow([PARTITION_MARKER, SNAPSHOT_VERSION, format_month(month)])
+        writer.writerows(_csv_rows(chain(existing, rows)))
+    return name
+
+
+# Delete partition files the snapshot no longer lists (left by a compaction, a save or a crash).
+# A file another process still has open may refuse to go; it is retried next time.
+def _remove_stale_partitions(partitions):
+    base = os.path.splitext(CSV_FILE)[0]
+    keep = set(partitions.values())
+    for path in glob.glob(f"{glob.escape(base)}.????-??.*.*"):
+        if not path.endswith(('.csv', COLUMNAR_SUFFIX)):
+            continue
+        if os.path.basename(path) not in keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# Split (seq, kind, args) entries into category entries, undated expense entries and dated
+# expense entries by month. Categories already in categories are skipped.
+def _split_entries(entries, categories, category_rows, undated_rows, months):
+    for entry in entries:
+        seq, kind, args = entry
+        if kind == 'category':
+            if args[0] in categories:
+                continue
+            categories.add(args[0])
+            category_rows.append(entry)
+        else:
+            month = month_of(args[0].timestamp)
+            rows = undated_rows if month is None else months.setdefault(month, [])
+            rows.append(entry)
+
+
+# Replace the journal with an empty one
+def _reset_journal():
+    global _journal_records, _journal_offset, _journal_identity
+    tmp_file = JOURNAL_FILE + '.tmp'
+    with open(tmp_file, mode='w', newline='') as file:
+        csv.writer(file).writerow([JOURNAL_MARKER, uuid.uuid4().hex])
+    os.replace(tmp_file, JOURNAL_FILE)
+    _journal_records = 0
+    _journal_offset = 0
+    _journal_identity = _current_journal_identity()
+
+
+# Save data to CSV files as a full snapshot with fresh partitions and empty the journal.
+# Changes other processes made first are merged into data, so they are not lost.
+def save_data(data):
+    global _generation, _partitions
+    with _journal_lock, _file_lock():
+        _sync()
+        for kind, args in _take_foreign_changes():
+            if kind == 'reload':
+                # Everything was replaced elsewhere; this save replaces it again
+                continue
+            apply_operation(data, kind, args)
+        _generation = uuid.uuid4().hex
+        category_rows, undated_rows, months = [], [], {}
+        entries = chain((('category', (category, values['budget'])) for category, values in data.items()),
+                        (('expense', (record,)) for values in data.values() for record in values['details']))
+        _split_entries(((0, kind, args) for kind, args in entries), set(), category_rows, undated_rows, months)
+        partitions = {month: _write_partition(month, None, rows) for month, rows in months.items()}
+        _write_snapshot(category_rows, undated_rows, _journal_seq, _generation, partitions)
+        _reset_journal()
+        _partitions = partitions
+        _remove_stale_partitions(partitions)
+
+
+# Append records to the journal in one write; each entry is (kind, fields).
+# Returns the changes other processes made since our last write.
+def _append_records(entries):
+    global _journal_seq, _journal_records, _journal_offset, _journal_identity
+    with _journal_lock, _file_lock():
+        _sync()
+        rows = [[_journal_seq + i, kind, *fields] for i, (kind, fields) in enumerate(entries, start=1)]
+        with open(JOURNAL_FILE, mode='a', newline='') as file:
+            csv.writer(file).writerows(rows)
+        _journal_seq += len(rows)
+        _journal_records += len(rows)
+        _journal_offset = os.path.getsize(JOURNAL_FILE)
+        _journal_identity = _current_journal_identity()
+        return _take_foreign_changes()
+
+
+# Record a new category without rewriting the snapshot
+def append_category(category, budget):
+    return _append_records([_operation_fields('category', (category, budget))])
+
+
+# Record a new expense without rewriting the snapshot
+def append_expense(record):
+    return _append_records([('expense', _expense_fields(record))])
+
+
+# Record several operations, ('category', (category, budget)) or ('expense', (record,)), in one write
+def append_batch(operations):
+    return _append_records([_operation_fields(kind, args) for kind, args in operations])
+
+
+# Changes other processes made since we last read or wrote, as operations
+# (a ('reload', ()) operation means the files were replaced and data should be loaded again)
+def sync_changes():
+    with _journal_lock, _file_lock():
+        _sync()
+        return _take_foreign_changes()
+
+
+# Move the journal into the snapshot and the month partitions, then empty the journal. Only the
+# partitions of months the journal touched are rewritten. Rows keep their journal seq, so other
+# processes can still find records they have not seen.
+def _compact():
+    global _partitions
+    with _journal_lock, _file_lock():
+        _sync()
+        snapshot_seq, generation, partitions = _snapshot_index()
+        category_rows, undated_rows, months = [], [], {}
+        entries, _ = _read_journal(0)
+        # The snapshot holds the categories and undated expenses (legacy rows are all undated)
+        _split_entries(chain(_snapshot_entries(_open_snapshot({})),
+                             (entry for entry in entries if entry[0] > snapshot_seq)),
+                       set(), category_rows, undated_rows, months)
+        partitions = dict(partitions)
+        for month, rows in months.items():
+            partitions[month] = _write_partition(month, partitions.get(month), rows)
+        _write_snapshot(category_rows, undated_rows, _journal_seq, generation, partitions)
+        _reset_journal()
+        _partitions = partitions
+        _remove_stale_partitions(partitions)
+
+
+# Start a background compaction once the journal grows past COMPACT_THRESHOLD
+def maybe_compact(data):
+    global _compaction_thread
+    if _journal_records < COMPACT_THRESHOLD:
+        return
+    if _compaction_thread is not None and _compaction_thread.is_alive():
+        return
+    _compaction_thread = threading.Thread(target=_compact, daemon=True)
+    _compaction_thread.start()
+
+
+# Wait for a running compaction to finish (used before exit)
+def wait_for_compaction():
+    if _compaction_thread is not None:
+        _compaction_thread.join()
+
+
+# Category totals as (category, budget, expenses). CSV files have to be read in full; columnar
+# partitions are summed straight from their amount and category columns.
+def category_totals():
+    data = {}
+    with _journal_lock, _file_lock():
+        files, tail, _ = _open_all()
+        columnar = [file for file in files if isinstance(file, ColumnarFile)]
+        text_files = [file for file in files if not isinstance(file, ColumnarFile)]
+        for seq, kind, args in chain(_snapshot_entries(text_files), tail):
+            apply_operation(data, kind, args)
+        for file in columnar:
+            with file:
+                for category, total in file.category_totals().items():
+                    if category in data:
+                        data[category]['expenses'] += total
+    return [(category, values['budget'], values['expenses']) for category, values in data.items()]
@@ -0,0 +1,231 @@
+import csv
+import datetime
+import os
+import re
+import threading
+from collections import Counter
+
+import storage
+from records import ExpenseRecord, month_of, to_cents
+
+# Rules mapping statement descriptions to categories: a CSV file of "pattern,category" rows.
+# A pattern matches when it appears anywhere in the description (case does not matter);
+# the first matching rule wins.
+RULES_FILE = 'import_rules.csv'
+
+# Category for transactions no rule or earlier expense accounts for (created when needed)
+DEFAULT_CATEGORY = 'Uncategorized'
+
+# Date layouts tried for CSV statements, in order
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y', '%m/%d/%y', '%d.%m.%Y', '%Y%m%d')
+
+# Header names (lowercase) recognised in CSV statements
+DATE_COLUMNS = ('date', 'transaction date', 'posted date', 'posting date', 'booking date', 'value date')
+DESCRIPTION_COLUMNS = ('description', 'payee', 'name', 'merchant', 'details', 'narrative', 'memo')
+AMOUNT_COLUMNS = ('amount', 'transaction amount', 'amount (usd)', 'value')
+DEBIT_COLUMNS = ('debit', 'withdrawal', 'withdrawals', 'paid out', 'money out')
+
+# Rows parsed between progress updates
+PROGRESS_INTERVAL = 10000
+
+
+# Read category rules as [(lowercase pattern, category)]; no file means no rules
+def load_rules(path=RULES_FILE):
+    try:
+        with open(path, mode='r', newline='') as file:
+            return [(row[0].strip().lower(), row[1].strip()) for row in csv.reader(file)
+                    if len(row) >= 2 and row[0].strip() and not row[0].startswith('#')]
+    except FileNotFoundError:
+        return []
+
+
+# Cents for an amount such as "-1,234.50", "$12.00" or "(12.00)"
+def parse_amount(value):
+    value = value.strip().replace(',', '').replace('$', '')
+    if value.startswith('(') and value.endswith(')'):
+        value = '-' + value[1:-1]
+    return to_cents(value) if value else 0
+
+
+# Timestamp (local midnight) for a statement date, trying each of DATE_FORMATS
+def parse_date(value):
+    value = value.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date '{value}'")
+
+
+# Index of the first header in names, or None
+def _column(header, names):
+    for name in names:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+# Yield (timestamp, description, spent in cents) for every outgoing transaction in a bank CSV export.
+# Spending is a negative amount, or any value in a debit column; incoming money is skipped.
+def parse_csv_statement(file):
+    reader = csv.reader(file)
+    header = [name.strip().lower() for name in next(reader, [])]
+    date_column = _column(header, DATE_COLUMNS)
+    description_column = _column(header, DESCRIPTION_COLUMNS)
+    amount_column = _column(header, AMOUNT_COLUMNS)
+    debit_column = _column(header, DEBIT_COLUMNS)
+    if date_column is None or description_column is None or (amount_column is None and debit_column is None):
+        raise ValueError("The statement needs date, description and amount (or debit) columns.")
+    # Statements repeat the same few dates over and over, so each is parsed once
+    dates = {}
+    for row in reader:
+        if len(row) <= max(column for column in (date_column, description_column, amount_column, debit_column)
+                           if column is not None):
+            continue
+        if debit_column is not None:
+            spent = parse_amount(row[debit_column])
+            if not spent and amount_column is not None:
+                spent = -parse_amount(row[amount_column])
+        else:
+            spent = -parse_amount(row[amount_column])
+        if spent <= 0:
+            continue
+        date = row[date_column]
+        timestamp = dates.get(date)
+        if timestamp is None:
+            timestamp = dates[date] = parse_date(date)
+        yield timestamp, row[description_column].strip(), spent
+
+
+# One <TAG>value element or </TAG> closing tag of an OFX (SGML or XML) statement
+_OFX_ELEMENT = re.compile(r'<(/?\w+)>([^<\r\n]*)')
+
+
+# Yield (timestamp, description, spent in cents) for every outgoing transaction in an OFX/QFX file
+def parse_ofx_statement(file):
+    dates = {}
+    transaction = None
+    for line in file:
+        for tag, value in _OFX_ELEMENT.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                transaction = {}
+            elif tag == '/STMTTRN' and transaction is not None:
+                amount = parse_amount(transaction.get('TRNAMT', '0'))
+                if amount < 0 and 'DTPOSTED' in transaction:
+                    date = transaction['DTPOSTED'][:8]
+                    timestamp = dates.get(date)
+                    if timestamp is None:
+                        timestamp = dates[date] = datetime.datetime.strptime(date, '%Y%m%d').timestamp()
+                    description = transaction.get('NAME') or transaction.get('MEMO') or transaction.get('PAYEE', '')
+                    yield timestamp, description, -amount
+                transaction = None
+            elif transaction is not None and value.strip():
+                transaction.setdefault(tag, value.strip())
+
+
+# Parser for a statement file, chosen by its extension
+def statement_parser(path):
+    if os.path.splitext(path)[1].lower() in ('.ofx', '.qfx'):
+        return parse_ofx_statement
+    return parse_csv_statement
+
+
+# Imports a bank statement in a background thread. The file is parsed and categorised off the
+# Tk thread, with progress in rows_read and fraction; once done is set, finish() adds the new
+# expenses to the ledger in one bulk write (call it from the thread that owns the ledger).
+# period is the period the ledger holds: the thread also reads the stored expenses of the
+# statement's other months, which the duplicate check needs.
+class StatementImport:
+    def __init__(self, path, rules=None, known_descriptions=None, period=None):
+        self.path = path
+        self.period = period
+        self.rules = load_rules() if rules is None else rules
+        # Description -> category learnt from earlier expenses, used when no rule matches
+        self.known_descriptions = known_descriptions or {}
+        self.rows_read = 0
+        self.fraction = 0.0
+        self.done = False
+        self.error = None
+        self._records = []
+        # Stored expenses per month, for the months outside period
+        self._stored = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    # Category for a description: the first matching rule, then earlier expenses, then the default
+    def categorise(self, description):
+        lowered = description.lower()
+        for pattern, category in self.rules:
+            if pattern in lowered:
+                return category
+        return self.known_descriptions.get(description, DEFAULT_CATEGORY)
+
+    def _run(self):
+        try:
+            size = os.path.getsize(self.path) or 1
+            parser = statement_parser(self.path)
+            categories = {}
+            records = self._records
+            with open(self.path, mode='r', newline='', encoding='utf-8-sig', errors='replace') as file:
+                for timestamp, description, amount in parser(file):
+                    # Descriptions repeat (the same shops), so each is categorised once
+                    category = categories.get(description)
+                    if category is None:
+                        category = categories[description] = self.categorise(description)
+                    records.append(ExpenseRecord(amount, description, timestamp, category))
+                    if len(records) % PROGRESS_INTERVAL == 0:
+                        self.rows_read = len(records)
+                        self.fraction = min(file.buffer.tell() / size, 1.0) if hasattr(file, 'buffer') else 0.0
+            self.rows_read = len(records)
+            if self.period is not None:
+                for month in {month_of(record.timestamp) for record in records} - {self.period}:
+                    self._stored[month] = storage.read_expenses(month)
+            self.fraction = 1.0
+        except Exception as error:
+            self.error = error
+        self.done = True
+
+    # Add the parsed expenses to the ledger, skipping ones it already holds, and create
+    # missing categories with a zero budget. Returns (expenses imported, duplicates skipped).
+    def finish(self, ledger):
+        records = self._records
+        self._records = []
+        if not records:
+            return 0, 0
+        # An expense is a duplicate when one with the same day, description and amount is
+        # already stored. Counting keeps genuine repeats (two coffees on one day) and makes
+        # importing the same statement twice harmless.
+        days = {}
+        existing = Counter(_duplicate_key(record, days) for record in ledger.stored_expenses(
+            {month_of(record.timestamp) for record in records}, self._stored))
+        new_records = []
+        for record in records:
+            key = _duplicate_key(record, days)
+            if existing[key]:
+                existing[key] -= 1
+            else:
+                new_records.append(record)
+        known = set(ledger.categories())
+        new_categories = sorted({record.category for record in new_records} - known)
+        ledger.add_bulk([(category, 0) for category in new_categories], new_records)
+        return len(new_records), len(records) - len(new_records)
+
+
+# Key identifying the same bank transaction twice: (day, description, amount).
+# days caches the day of each timestamp seen, as statement timestamps repeat.
+def _duplicate_key(record, days):
+    day = days.get(record.timestamp)
+    if day is None:
+        day = days[record.timestamp] = datetime.date.fromtimestamp(record.timestamp).toordinal()
+    return day, record.description, record.amount
+
+
+# Description -> category of earlier expenses, read from the ledger's per-description aggregates
+def known_descriptions(ledger):
+    return {description: category
+            for category, descriptions in ledger.aggregates.descriptions.items()
+            for description in descriptions}
@@ -0,0 +1,187 @@
+import cProfile
+import functools
+import io
+import json
+import math
+import os
+import platform
+import pstats
+import threading
+import time
+import tracemalloc
+
+# Timings are recorded unless the EXPENSE_TRACKER_INSTRUMENTATION environment variable is 0
+ENABLED = os.environ.get('EXPENSE_TRACKER_INSTRUMENTATION', '1') != '0'
+
+# Latency histogram buckets: the first ends at SMALLEST seconds and each is GROWTH times wider
+# than the one before, so percentiles are within about 10% from microseconds to minutes
+SMALLEST = 1e-6
+GROWTH = 2 ** 0.25
+BUCKETS = 120
+
+# Lines of the profile and allocation reports
+PROFILE_LINES = 30
+ALLOCATION_LINES = 20
+
+
+# Durations of one operation in log-spaced buckets, with exact count, total and maximum
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds <= SMALLEST:
+            index = 0
+        else:
+            index = min(BUCKETS - 1, int(math.log(seconds / SMALLEST, GROWTH)) + 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Duration below which fraction of the recordings fall (the upper end of its bucket,
+    # never more than the slowest recording)
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(SMALLEST * GROWTH ** index, self.max)
+        return self.max
+
+
+_histograms = {}
+_lock = threading.Lock()
+
+
+# Add one duration of the named operation
+def record(name, seconds):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = LatencyHistogram()
+        histogram.record(seconds)
+
+
+# Context manager timing its block as the named operation (exceptions are timed too)
+class timing:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if ENABLED:
+            record(self.name, time.perf_counter() - self.start)
+
+
+# Decorator timing every call of a function as the named operation (module.function by default)
+def timed(name=None):
+    def decorate(function):
+        operation = name or f"{function.__module__}.{function.__name__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timing(operation):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Forget every recorded duration
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+# One dict per operation (name, count, total, mean, p50, p90, p99, max; seconds), most total time first
+def summary():
+    with _lock:
+        histograms = [(name, histogram, histogram.count) for name, histogram in _histograms.items()]
+        rows = [{
+            'name': name,
+            'count': count,
+            'total': histogram.total,
+            'mean': histogram.total / count,
+            'p50': histogram.percentile(0.5),
+            'p90': histogram.percentile(0.9),
+            'p99': histogram.percentile(0.99),
+            'max': histogram.max,
+        } for name, histogram, count in histograms if count]
+    rows.sort(key=lambda row: row['total'], reverse=True)
+    return rows
+
+
+# The summary as a text table, durations in milliseconds
+def format_summary(rows=None):
+    rows = summary() if rows is None else rows
+    lines = [f"{'operation':<32} {'count':>8} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10} {'total s':>9}"]
+    for row in rows:
+        lines.append(f"{row['name']:<32} {row['count']:>8} {row['p50'] * 1000:>10.2f} {row['p99'] * 1000:>10.2f}"
+                     f" {row['max'] * 1000:>10.2f} {row['total']:>9.2f}")
+    return '\n'.join(lines)
+
+
+# Profiling capture: cProfile on the thread that starts it (the Tk thread in the app) and
+# tracemalloc for every thread. Both slow the app down noticeably, so they only run on request.
+_profile = None
+_last_report = None
+
+
+def profiling():
+    return _profile is not None
+
+
+def start_profiling():
+    global _profile
+    if _profile is not None:
+        return
+    _profile = cProfile.Profile()
+    tracemalloc.start()
+    _profile.enable()
+
+
+# Stop the capture and return its report (also kept for export_report)
+def stop_profiling():
+    global _profile, _last_report
+    if _profile is None:
+        return _last_report
+    _profile.disable()
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    text = io.StringIO()
+    pstats.Stats(_profile, stream=text).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    text.write(f"\nTraced memory: {current / 2 ** 20:.1f} MB now, {peak / 2 ** 20:.1f} MB peak\n")
+    text.write(f"Top {ALLOCATION_LINES} allocation sites:\n")
+    for statistic in snapshot.statistics('lineno')[:ALLOCATION_LINES]:
+        text.write(f"  {statistic}\n")
+    _profile = None
+    _last_report = text.getvalue()
+    return _last_report
+
+
+# Write the latency summary, the last profile report and extra (JSON-friendly) details to a
+# JSON file, to attach to a performance bug report
+def export_report(path, extra=None):
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'operations': summary(),
+        'profile': _last_report,
+    }
+    report.update(extra or {})
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
@@ -0,0 +1,203 @@
+import storage
+from aggregates import ExpenseAggregates
+from records import MAX_CENTS, ExpenseRecord, apply_operation, new_record, month_bounds, to_cents
+from search import CategoryIndex, ExpenseIndex
+from suggestions import DescriptionIndex
+
+
+# Raised for changes the ledger refuses (duplicate or unknown category, bad amount)
+class LedgerError(ValueError):
+    pass
+
+
+class DuplicateCategoryError(LedgerError):
+    pass
+
+
+class UnknownCategoryError(LedgerError):
+    pass
+
+
+# Categories, expenses and their aggregates, with no UI attached. Budgets and amounts are
+# given in dollars (text or numbers) and held, stored and returned as whole cents.
+# Every change is passed to sink as a list of storage operations
+# (('category', (category, budget)) or ('expense', (record,))); by default they
+# are written straight to storage, the Tk app passes its persistence worker instead.
+# A ledger holds one period: a month (year, month), whose expenses are measured against
+# the category budgets, or None for the whole history. Expenses outside it are stored
+# but not kept in memory. version goes up with every change to what is held, so views
+# derived from the ledger (the chart) can tell whether they are still current.
+class ExpenseLedger:
+    def __init__(self, sink=storage.append_batch, period=None):
+        self.sink = sink
+        self.period = period
+        self.data = {}
+        self.aggregates = ExpenseAggregates()
+        self.descriptions = DescriptionIndex()
+        self.search_index = ExpenseIndex()
+        self.category_index = CategoryIndex()
+        self.version = 0
+
+    # Ledger holding a period (or everything) from storage
+    @classmethod
+    def load(cls, sink=storage.append_batch, period=None):
+        ledger = cls(sink, period)
+        ledger.apply_operations(storage.stream_data(period))
+        return ledger
+
+    # Whether a record belongs to the period this ledger holds
+    def in_period(self, record):
+        if self.period is None:
+            return True
+        if record.timestamp is None:
+            return False
+        start, end = month_bounds(self.period)
+        return start <= record.timestamp < end
+
+    # Forget everything held in memory (stored data is untouched)
+    def clear(self):
+        self.data.clear()
+        self.aggregates = ExpenseAggregates()
+        self.descriptions = DescriptionIndex()
+        self.search_index = ExpenseIndex()
+        self.category_index = CategoryIndex()
+        self.version += 1
+
+    # Apply operations that are already stored (loaded, or saved by another instance).
+    # Returns (whether new categories arrived, the expense records applied); expenses
+    # outside the ledger's period are skipped.
+    def apply_operations(self, operations):
+        categories_changed = False
+        changed = False
+        records = []
+        start, end = month_bounds(self.period) if self.period is not None else (None, None)
+        for kind, args in operations:
+            if kind == 'category':
+                if args[0] not in self.data:
+                    categories_changed = True
+                    self.category_index.add(args[0])
+                apply_operation(self.data, kind, args)
+                changed = True
+            elif kind == 'expense':
+                if start is not None:
+                    timestamp = args[0].timestamp
+                    if timestamp is None or not start <= timestamp < end:
+                        continue
+                apply_operation(self.data, kind, args)
+                records.append(args[0])
+        self.aggregates.add_many(records)
+        self.descriptions.add_many(records)
+        self.search_index.add_many(records)
+        if changed or records:
+            self.version += 1
+        return categories_changed, records
+
+    # Add one category
+    def add_category(self, category, budget):
+        self.add_categories_bulk([(category, budget)])
+
+    # Add several categories as (category, budget) pairs, validated together and stored in one write
+    def add_categories_bulk(self, categories):
+        self.add_bulk(categories, [])
+
+    # Add one expense, returning its record
+    def add_expense(self, category, description, amount):
+        return self.add_expenses_bulk([(category, description, amount)])[0]
+
+    # Add several expenses as (category, description, amount) or ExpenseRecord,
+    # validated together and stored in one write. Returns the new records.
+    def add_expenses_bulk(self, expenses):
+        return self.add_bulk([], expenses)
+
+    # Add categories and expenses together (an import), validated first and stored in one write.
+    # Expenses may belong to the new categories. Returns the new expense records
+    # (including any outside the ledger's period, which are stored but not held).
+    def add_bulk(self, categories, expenses):
+        operations = []
+        new_categories = set()
+        for category, budget in categories:
+            budget = to_cents(budget)
+            if category in self.data or category in new_categories:
+                raise DuplicateCategoryError(f"Category '{category}' already exists.")
+            new_categories.add(category)
+            operations.append(('category', (category, budget)))
+        records = []
+        for expense in expenses:
+            if isinstance(expense, ExpenseRecord):
+                record = expense
+                if abs(record.amount) > MAX_CENTS:
+                    raise ValueError(f"Amount of '{record.description}' is too large")
+            else:
+                category, description, amount = expense
+                record = new_record(category, description, amount)
+            if record.category not in self.data and record.category not in new_categories:
+                raise UnknownCategoryError(f"Category '{record.category}' does not exist.")
+            records.append(record)
+        operations.extend(('expense', (record,)) for record in records)
+        self.apply_operations(operations)
+        self.sink(operations)
+        return records
+
+    # Queries
+
+    def categories(self):
+        return list(self.data)
+
+    # Categories starting with prefix (ignoring case), sorted, at most limit of them
+    def find_categories(self, prefix='', limit=None):
+        return self.category_index.lookup(prefix, limit)
+
+    def budget(self, category):
+        return self.data[category]['budget']
+
+    # Spent in a category during the ledger's period
+    def total(self, category):
+        return self.aggregates.category(category).total
+
+    def spent_this_month(self, category):
+        return self.aggregates.spent_this_month(category)
+
+    # Budget left in the ledger's period; budgets start again every month
+    def remaining_budget(self, category):
+        return self.aggregates.remaining_budget(category, self.budget(category))
+
+    def is_over_budget(self, category):
+        return self.total(category) > self.budget(category)
+
+    # Expense records, for one category or all of them in category order
+    def expenses(self, category=None):
+        if category is not None:
+            return list(self.data[category]['details'])
+        return [record for values in self.data.values() for record in values['details']]
+
+    # Stored expenses in months (year, month): from memory for the period this ledger holds
+    # (so expenses added but not written yet count), and for the other months from stored
+    # ({month: records} read off the Tk thread), reading any month it lacks from storage
+    def stored_expenses(self, months, stored=None):
+        months = sorted(months)
+        start, end = month_bounds(months[0])[0], month_bounds(months[-1])[1]
+        if self.period is None or self.period in months:
+            for record in self.expenses():
+                if record.timestamp is not None and start <= record.timestamp < end:
+                    yield record
+        if self.period is not None:
+            for month in months:
+                if month != self.period:
+                    read = stored.get(month) if stored is not None else None
+                    yield from storage.read_expenses(month) if read is None else read
+
+    # Expenses matching a SearchQuery, in the order they were added
+    def search(self, query):
+        return self.search_index.search(query)
+
+    # Past descriptions in a category starting with prefix, most used (and most recent) first
+    def suggest_descriptions(self, category, prefix):
+        return self.descriptions.suggest(category, prefix)
+
+    # The amount usually spent on a description in a category, or None
+    def usual_amount(self, category, description):
+        return self.descriptions.usual_amount(category, description)
+
+    # (category, budget, spent) for every category
+    def category_totals(self):
+        return [(category, values['budget'], self.total(category)) for category, values in self.data.items()]
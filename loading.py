@@ -0,0 +1,70 @@
+import queue
+import threading
+
+import storage
+
+# Operations handed to the UI at a time
+BATCH_SIZE = 5000
+
+# Batches parsed ahead of the UI; the reader waits when this many are queued,
+# which keeps memory bounded however large the history is
+QUEUE_BATCHES = 4
+
+_DONE = object()
+
+
+# Streams stored operations in a background thread and hands them to the Tk thread in batches
+class BackgroundLoader:
+    def __init__(self, operations=None):
+        self._operations = storage.stream_data() if operations is None else operations
+        self._batches = queue.Queue(maxsize=QUEUE_BATCHES)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.done = False
+        self.error = None
+        self._cancelled = False
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        batch = []
+        try:
+            for operation in self._operations:
+                if self._cancelled:
+                    return
+                batch.append(operation)
+                if len(batch) >= BATCH_SIZE:
+                    self._batches.put(batch)
+                    batch = []
+            if batch:
+                self._batches.put(batch)
+        except Exception as error:
+            self._batches.put(error)
+        self._batches.put(_DONE)
+
+    # Stop loading and drop whatever was read ahead
+    def cancel(self):
+        self._cancelled = True
+        self.done = True
+        while True:
+            try:
+                self._batches.get_nowait()
+            except queue.Empty:
+                return
+
+    # Next batch of operations; waits for it when block is true. Returns None once
+    # nothing more is ready, or when loading has finished (see done and error).
+    def next_batch(self, block=False):
+        if self.done:
+            return None
+        try:
+            item = self._batches.get(block=block)
+        except queue.Empty:
+            return None
+        if item is _DONE:
+            self.done = True
+            return None
+        if isinstance(item, Exception):
+            self.error = item
+            return []
+        return item
@@ -1,55 +1,29 @@
 import tkinter as tk
-from tkinter import messagebox, ttk
-import csv
-import os
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-
-# Attempt to use a more modern Tk backend
-try:
-    import tkinter.tix as tix
-except ImportError:
-    tix = None
-
-# File to store categories and expenses data
-CSV_FILE = 'categories_expenses.csv'
-
-# Load data from CSV file
-def load_data():
-    data = {}
-    if os.path.exists(CSV_FILE):
-        with open(CSV_FILE, mode='r', newline='') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                category, budget, expenses, *expense_details = row
-                data[category] = {
-                    'budget': float(budget), 
-                    'expenses': float(expenses), 
-                    'details': expense_details
-                }
-    return data
-
-# Save data to CSV file
-def save_data(data):
-    with open(CSV_FILE, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        for category, values in data.items():
-            writer.writerow([
-                category, 
-                values['budget'], 
-                values['expenses']
-            ] + values['details'])
-
-# Function to update labels showing current and remaining budget
+from tkinter import filedialog, messagebox, ttk
+import datetime
+import importlib
+import threading
+
+from ledger import ExpenseLedger, DuplicateCategoryError, UnknownCategoryError
+from widgets import VirtualTreeview, AutocompleteEntry, CategorySelector
+from persistence import PersistenceWorker
+from refresh import RefreshScheduler
+from chart_cache import ChartCache
+import instrumentation
+from instrumentation import timing
+from loading import BackgroundLoader
+from importer import StatementImport, known_descriptions
+from recurring import RecurringPostings
+from search import SearchQuery
+from storage import maybe_compact, wait_for_compaction, stream_data, list_periods, export_csv, STORAGE_BACKEND
+from records import current_month, format_month, parse_month, to_cents, format_cents, format_money
+
+# Function to update labels showing current and remaining budget for the period on screen
 def update_budget_labels(category):
-    current_expenses = data[category]['expenses']
-    budget = data[category]['budget']
-    remaining_budget = budget - current_expenses
-    expenses_label.config(text=f"Current Expenses: ${current_expenses:.2f}")
-    remaining_budget_label.config(text=f"Remaining Budget: ${remaining_budget:.2f}")
-    
-    # Update recent expenses treeview
-    refresh_recent_expenses()
+    current_expenses = ledger.total(category)
+    remaining_budget = ledger.remaining_budget(category)
+    expenses_label.config(text=f"Expenses in {period_name(ledger.period)}: {format_money(current_expenses)}")
+    remaining_budget_label.config(text=f"Remaining Budget: {format_money(remaining_budget)}")
 
 # Add a new category to the data
 def add_category():
@@ -58,16 +32,14 @@ def add_category():
     
     if category and budget:
         try:
-            budget = float(budget)
-            if category not in data:
-                data[category] = {'budget': budget, 'expenses': 0.0, 'details': []}
-                save_data(data)
-                refresh_categories(category)
-                category_entry.delete(0, tk.END)
-                budget_entry.delete(0, tk.END)
-                messagebox.showinfo("Category Added", f"Category '{category}' added with a budget of ${budget:.2f}.")
-            else:
-                messagebox.showwarning("Duplicate Category", "This category already exists.")
+            ledger.add_category(category, budget)
+            selected_category.set(category)
+            refresh.mark('categories', 'chart')
+            category_entry.delete(0, tk.END)
+            budget_entry.delete(0, tk.END)
+            messagebox.showinfo("Category Added", f"Category '{category}' added with a budget of {format_money(ledger.budget(category))}.")
+        except DuplicateCategoryError:
+            messagebox.showwarning("Duplicate Category", "This category already exists.")
         except ValueError:
             messagebox.showerror("Input Error", "Please enter a valid budget amount.")
     else:
@@ -80,119 +52,600 @@ def add_expense():
     description = description_entry.get().strip()
     
     if category and expense and description:
+        # A new month may have started since the current month was opened
+        if following_current_month and ledger.period != current_month():
+            load_period(current_month())
         try:
-            expense = float(expense)
-            data[category]['expenses'] += expense
-            data[category]['details'].append(f"{description}: {expense}")
-            save_data(data)
-            
-            if data[category]['expenses'] > data[category]['budget']:
+            record = ledger.add_expense(category, description, expense)
+            if not ledger.in_period(record):
+                messagebox.showinfo("Expense Added",
+                    f"The expense was added to {period_name(current_month())}, "
+                    f"which is not the period on screen.")
+            elif ledger.is_over_budget(category):
                 messagebox.showwarning("Budget Exceeded", 
                     f"Expenses for '{category}' have exceeded the budget!\n"
-                    f"Budget: ${data[category]['budget']:.2f}\n"
-                    f"Total Expenses: ${data[category]['expenses']:.2f}"
+                    f"Budget: {format_money(ledger.budget(category))}\n"
+                    f"Total Expenses: {format_money(ledger.total(category))}"
                 )
             
             # Clear expense entry fields
             expense_entry.delete(0, tk.END)
             description_entry.delete(0, tk.END)
+            description_entry.hide()
             
-            update_budget_labels(category)
+            refresh.mark('budget')
+            if ledger.in_period(record):
+                queue_new_expenses([record])
+        except UnknownCategoryError:
+            messagebox.showwarning("Input Error", "Please add a category first.")
         except ValueError:
             messagebox.showerror("Input Error", "Please enter a valid number for the expense.")
     else:
         messagebox.showwarning("Input Error", "Please fill in all fields (category, expense, and description).")
 
-# Refresh category dropdown and listbox
-def refresh_categories(new_category=None):
-    # Update category dropdown
-    category_dropdown['menu'].delete(0, 'end')
-    categories = list(data.keys())
-    
-    if categories:
-        for category in categories:
-            category_dropdown['menu'].add_command(
-                label=category, 
-                command=lambda cat=category: selected_category.set(cat)
-            )
-        
-        # Set default category
-        if new_category:
-            selected_category.set(new_category)
-        else:
-            selected_category.set(categories[0])
+# Refresh the category selectors. They look categories up in the ledger's sorted index as the
+# user types, so nothing is rebuilt here; an open list is just looked up again.
+def refresh_categories():
+    category_selector.refresh()
+    search_category_selector.refresh()
+    if chart_category_selector is not None:
+        chart_category_selector.refresh()
+
+    # Keep the selected category, or fall back to the first one
+    if ledger.data:
+        if selected_category.get() not in ledger.data:
+            selected_category.set(next(iter(ledger.data)))
     else:
         selected_category.set("No categories available")
 
-# Refresh recent expenses treeview
+# Budget labels for the selected category
+def refresh_budget_labels():
+    if selected_category.get() in ledger.data:
+        update_budget_labels(selected_category.get())
+
+# What the budget labels show; they are redrawn only when it changes
+def budget_state():
+    category = selected_category.get()
+    if category not in ledger.data:
+        return None
+    return category, ledger.period, ledger.total(category), ledger.remaining_budget(category)
+
+# Expenses waiting to be added to the treeview, and whether it needs filling from scratch
+pending_expenses = []
+expenses_reset = False
+
+# Add expenses to the treeview on the next refresh pass
+def queue_new_expenses(records):
+    if records:
+        pending_expenses.extend(records)
+        refresh.mark('expenses', 'chart')
+
+# Fill the treeview from scratch on the next refresh pass
+def queue_expense_refresh():
+    global expenses_reset
+    expenses_reset = True
+    refresh.mark('expenses', 'chart')
+
+# Apply queued treeview changes in one go
+def redraw_expenses():
+    global expenses_reset
+    if expenses_reset:
+        # The full refresh already includes everything queued
+        refresh_recent_expenses()
+    else:
+        show_new_expenses(pending_expenses)
+    expenses_reset = False
+    pending_expenses.clear()
+
+# How often the UI checks the persistence worker for saved changes (ms)
+PERSISTENCE_POLL_MS = 200
+
+# Set when another process replaced the stored data; handled once our own changes are saved
+reload_requested = False
+
+# Merge changes other app instances saved into data and the widgets
+# (held back until loading finishes, so they never arrive before the category they belong to)
+def merge_external_changes(changes):
+    global reload_requested
+    if not loader.done:
+        deferred_changes.extend(changes)
+        return
+    if any(kind == 'reload' for kind, args in changes):
+        reload_requested = True
+        changes = [(kind, args) for kind, args in changes if kind != 'reload']
+    categories_changed, records = ledger.apply_operations(changes)
+    queue_new_expenses(records)
+    if categories_changed:
+        refresh.mark('categories', 'chart')
+    refresh.mark('budget')
+
+# How often the UI checks for more loaded history while it is still being read (ms)
+LOAD_POLL_MS = 50
+
+# Feed the rest of the history into the UI one batch per event loop pass
+def continue_loading():
+    batch = loader.next_batch()
+    if batch:
+        with timing('load.apply_batch'):
+            categories_changed, records = ledger.apply_operations(batch)
+        queue_new_expenses(records)
+        if categories_changed:
+            refresh.mark('categories', 'chart')
+    if not loader.done:
+        root.after(0 if batch else LOAD_POLL_MS, continue_loading)
+        return
+    if loader.error:
+        messagebox.showerror("Load Error", f"Could not read all saved expenses: {loader.error}")
+    merge_external_changes(deferred_changes)
+    deferred_changes.clear()
+    ledger.descriptions.sort_keys()
+    ledger.search_index.prepare()
+    ledger.category_index.merge()
+    refresh.mark('budget')
+    post_recurring()
+
+# How often recurring expenses are checked for postings that fell due (ms)
+RECURRING_POLL_MS = 60000
+# How often a running check is polled for its result (ms)
+RECURRING_CHECK_POLL_MS = 100
+
+# Recurring expense rules, the next scheduled check and the check running now
+recurring = RecurringPostings()
+recurring_job = None
+recurring_check = None
+
+# Look for recurring expenses that fell due, reading what the lookup needs in a background
+# thread, then check again later
+def post_recurring():
+    global recurring_job, recurring_check
+    if recurring_job is not None:
+        root.after_cancel(recurring_job)
+    recurring_job = root.after(RECURRING_POLL_MS, post_recurring)
+    if recurring_check is not None:
+        return
+    check = recurring_check = {}
+    categories, period = set(ledger.categories()), ledger.period
+    def run():
+        try:
+            check['due'], check['stored'] = recurring.collect(categories, period)
+        except Exception as error:
+            check['error'] = error
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    finish_recurring(thread, check)
+
+# Add the postings of a finished check in one batch
+def finish_recurring(thread, check):
+    global recurring_check
+    if thread.is_alive():
+        root.after(RECURRING_CHECK_POLL_MS, finish_recurring, thread, check)
+        return
+    recurring_check = None
+    errors = recurring.new_errors()
+    if errors:
+        messagebox.showwarning("Recurring Expenses", "\n".join(errors))
+    if 'due' not in check:
+        import_status_label.config(text=f"Could not read recurring expenses: "
+                                        f"{check.get('error', 'the check stopped unexpectedly')}")
+        return
+    records = recurring.post(ledger, check['due'], check['stored'])
+    if records:
+        queue_new_expenses([record for record in records if ledger.in_period(record)])
+        refresh.mark('budget')
+        import_status_label.config(text=f"Posted {len(records):,} recurring expense(s)")
+
+# Record how far the recurring expenses are posted, once the postings are saved
+def confirm_recurring():
+    try:
+        recurring.confirm()
+    except OSError as error:
+        import_status_label.config(text=f"Could not update {recurring.path}: {error}")
+
+# Start streaming the ledger's period; the first batch is applied before the window is built
+def start_loading():
+    global loader
+    loader = BackgroundLoader(stream_data(ledger.period))
+    loader.start()
+    ledger.apply_operations(loader.next_batch(block=True) or [])
+
+# Period waiting to be opened until our own changes are saved, as (period,); None when none waits
+requested_period = None
+
+# Drop what is in memory and load a period: a month (year, month) or None for all history.
+# Changes still being saved would be missing from the loaded period, so until the persistence
+# worker has written them the period is only requested and check_persistence opens it.
+def load_period(period):
+    global requested_period, reload_requested
+    selected_period.set(ALL_HISTORY if period is None else format_month(period))
+    if persistence.pending:
+        requested_period = (period,)
+        return
+    requested_period = None
+    reload_requested = False
+    loader.cancel()
+    # Changes held back for the cancelled load are read again from storage with the new period
+    deferred_changes.clear()
+    ledger.clear()
+    ledger.period = period
+    start_loading()
+    refresh.mark('categories', 'budget', 'chart')
+    queue_expense_refresh()
+    root.after(0, continue_loading)
+
+# Load everything again after another process replaced the stored data
+def reload_data():
+    load_period(ledger.period)
+
+# Period selector value for the whole history
+ALL_HISTORY = "All history"
+
+# "March 2024" for a month, ALL_HISTORY for None
+def period_name(period):
+    if period is None:
+        return ALL_HISTORY
+    return datetime.date(period[0], period[1], 1).strftime("%B %Y")
+
+# Fill the period selector with the months that have expenses, newest first
+def list_period_choices():
+    months = set(list_periods())
+    months.add(current_month())
+    period_combo['values'] = [format_month(month) for month in sorted(months, reverse=True)] + [ALL_HISTORY]
+
+# Open the period picked in the selector
+def select_period(event=None):
+    global following_current_month
+    choice = selected_period.get()
+    period = None if choice == ALL_HISTORY else parse_month(choice)
+    following_current_month = period == current_month()
+    if period != ledger.period or requested_period is not None:
+        load_period(period)
+
+# Show whether every change has reached disk, and compact once nothing is pending
+def check_persistence():
+    failure = None
+    for saved, error, external in persistence.poll():
+        failure = error
+        merge_external_changes(external)
+    if failure:
+        save_status_label.config(text=f"Save failed, retrying: {failure}")
+    elif persistence.pending == 0:
+        if requested_period is not None:
+            load_period(requested_period[0])
+        elif reload_requested:
+            reload_data()
+        save_status_label.config(text="All changes saved")
+        maybe_compact(ledger.data)
+        if recurring.unconfirmed and recurring_check is None:
+            confirm_recurring()
+    else:
+        save_status_label.config(text=f"Saving {persistence.pending} change(s)...")
+    root.after(PERSISTENCE_POLL_MS, check_persistence)
+
+# Format an expense record as a row of the recent expenses treeview
+def format_expense_row(record):
+    return (record.category, record.description, format_money(record.amount))
+
+# Refresh recent expenses treeview (only the visible rows become Treeview items)
 def refresh_recent_expenses():
-    # Clear existing items
-    for i in recent_expenses_tree.get_children():
-        recent_expenses_tree.delete(i)
-    
-    # Populate with recent expenses
-    for category, details in data.items():
-        for expense_detail in details['details']:
-            description, amount = expense_detail.split(': ')
-            recent_expenses_tree.insert('', 'end', values=(category, description, f"${float(amount):.2f}"))
+    if search_query.is_empty():
+        recent_expenses_tree.set_rows(ledger.expenses())
+        search_status_label.config(text="")
+    else:
+        rows = ledger.search(search_query)
+        recent_expenses_tree.set_rows(rows)
+        search_status_label.config(text=f"{len(rows):,} matching expenses")
+
+# Add new expenses to the treeview, if they match the current search
+def show_new_expenses(records):
+    if search_query.is_empty():
+        recent_expenses_tree.extend_rows(records)
+        return
+    records = [record for record in records if search_query.matches(record)]
+    if records:
+        recent_expenses_tree.extend_rows(records)
+        search_status_label.config(text=f"{len(recent_expenses_tree.rows):,} matching expenses")
+
+# Search box value meaning no category filter
+ALL_CATEGORIES = "All categories"
+
+# How long to wait after the last keystroke before searching (ms)
+SEARCH_DELAY_MS = 150
+
+# Build a SearchQuery from the search widgets; raises ValueError for a bad amount or date
+def read_search_query():
+    category = search_category.get()
+    if category not in ledger.data:
+        category = ALL_CATEGORIES
+    min_amount = search_min_entry.get().strip()
+    max_amount = search_max_entry.get().strip()
+    start = search_from_entry.get().strip()
+    end = search_to_entry.get().strip()
+    return SearchQuery(
+        text=search_text_entry.get(),
+        category=None if category in ('', ALL_CATEGORIES) else category,
+        min_amount=to_cents(min_amount) if min_amount else None,
+        max_amount=to_cents(max_amount) if max_amount else None,
+        start=datetime.datetime.strptime(start, DATE_FORMAT).timestamp() if start else None,
+        # The "to" date is included, so the range ends at midnight after it
+        end=(datetime.datetime.strptime(end, DATE_FORMAT) + datetime.timedelta(days=1)).timestamp() if end else None,
+    )
+
+# Run the search once typing pauses
+def schedule_search(event=None):
+    global search_job
+    if search_job is not None:
+        root.after_cancel(search_job)
+    search_job = root.after(SEARCH_DELAY_MS, run_search)
+
+def run_search():
+    global search_query, search_job
+    search_job = None
+    try:
+        search_query = read_search_query()
+    except ValueError:
+        search_status_label.config(text=f"Enter amounts as numbers and dates as {DATE_HINT}")
+        return
+    queue_expense_refresh()
+
+# Remove every search filter
+def clear_search():
+    for entry in (search_text_entry, search_min_entry, search_max_entry, search_from_entry, search_to_entry):
+        entry.delete(0, tk.END)
+    search_category.set(ALL_CATEGORIES)
+    run_search()
+
+# How often the UI checks a running statement import for progress (ms)
+IMPORT_POLL_MS = 100
+
+# Import a bank statement (CSV or OFX) in the background
+def import_statement():
+    global statement_import
+    if statement_import is not None and not statement_import.done:
+        messagebox.showinfo("Import Running", "A statement is already being imported.")
+        return
+    path = filedialog.askopenfilename(
+        title="Import Bank Statement",
+        filetypes=[("Bank statements", "*.csv *.ofx *.qfx"), ("All files", "*.*")]
+    )
+    if not path:
+        return
+    statement_import = StatementImport(path, known_descriptions=known_descriptions(ledger), period=ledger.period)
+    statement_import.start()
+    import_btn.state(['disabled'])
+    check_import()
+
+# Show import progress, then add everything to the ledger and refresh the widgets once
+def check_import():
+    if not statement_import.done:
+        import_progress['value'] = statement_import.fraction * 100
+        import_status_label.config(text=f"Importing... {statement_import.rows_read:,} transactions read")
+        root.after(IMPORT_POLL_MS, check_import)
+        return
+    import_btn.state(['!disabled'])
+    import_progress['value'] = 0
+    if statement_import.error:
+        import_status_label.config(text="")
+        messagebox.showerror("Import Error", f"Could not import the statement: {statement_import.error}")
+        return
+    imported, duplicates = statement_import.finish(ledger)
+    import_status_label.config(text=f"Imported {imported:,} expenses ({duplicates:,} duplicates skipped)")
+    refresh.mark('categories', 'budget', 'chart')
+    queue_expense_refresh()
+
+# Write the expenses of the period on screen to a CSV file, in a background thread
+def export_expenses():
+    if persistence.pending:
+        messagebox.showinfo("Export", "Please wait until all changes are saved, then export again.")
+        return
+    path = filedialog.asksaveasfilename(
+        title="Export Expenses", defaultextension=".csv",
+        initialfile=f"expenses {period_name(ledger.period)}.csv",
+        filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+    )
+    if not path:
+        return
+    export = {}
+    def run():
+        try:
+            export['count'] = export_csv(path, ledger.period)
+        except Exception as error:
+            export['error'] = error
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    export_btn.state(['disabled'])
+    import_status_label.config(text="Exporting...")
+    check_export(thread, export)
+
+# Report a finished export
+def check_export(thread, export):
+    if thread.is_alive():
+        root.after(IMPORT_POLL_MS, check_export, thread, export)
+        return
+    export_btn.state(['!disabled'])
+    if 'count' not in export:
+        import_status_label.config(text="")
+        messagebox.showerror("Export Error", f"Could not export the expenses: "
+                             f"{export.get('error', 'the export stopped unexpectedly')}")
+    else:
+        import_status_label.config(text=f"Exported {export['count']:,} expenses")
 
+# Past descriptions in the selected category starting with the typed text
+def suggest_descriptions(prefix):
+    return ledger.suggest_descriptions(selected_category.get(), prefix)
 
-def plot_detailed_expenses():
-    plt.figure(figsize=(12, 7))
-    
-    # Prepare data for main and sub-expenses
-    categories = []
-    total_expenses = []
-    sub_expenses = []
-    sub_expense_details = []
-    
-    for category, cat_data in data.items():
-        categories.append(category)
-        total_expenses.append(cat_data['expenses'])
-        
-        # Collect sub-expenses and descriptions
-        category_subs = []
-        expense_details = []
-        for detail in cat_data['details']:
-            desc, amount = detail.split(': ')
-            category_subs.append((desc, float(amount)))
-            expense_details.append((desc, float(amount)))
-        sub_expenses.append(category_subs)
-        sub_expense_details.append(expense_details)
-    
-    # Create stacked bar chart for total expenses
-    bar_width = 0.5
-    bars = plt.bar(categories, total_expenses, width=bar_width, color='#2a9d8f', edgecolor='white')
-    
-    # Add sub-expense details with labels
-    for i, (category_bars, sub_expense_list, expense_details) in enumerate(zip(bars, sub_expenses, sub_expense_details)):
-        bottom = 0
-        for desc, amount in sub_expense_list:
-            plt.bar(category_bars.get_x() + bar_width/2, amount, width=bar_width/2, 
-                    bottom=bottom, color='#e76f51', edgecolor='white', alpha=0.7)
-            
-            # Annotate the sub-expense
-            plt.text(category_bars.get_x() + bar_width/2, bottom + amount / 2, 
-                     f"{desc}\n${amount:.2f}", ha='center', va='center', fontsize=9, color='black')
-            bottom += amount
-    
-    plt.title("Detailed Expenses by Category", fontsize=16, fontweight='bold')
-    plt.xlabel("Categories", fontsize=12)
-    plt.ylabel("Total Expenses", fontsize=12)
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    plt.show()
+# Fill in the usual amount for a picked description, unless an amount was already typed
+def fill_usual_amount(description):
+    amount = ledger.usual_amount(selected_category.get(), description)
+    if amount is not None and not expense_entry.get().strip():
+        expense_entry.insert(0, format_cents(amount))
 
+# The chart window and its panel while the chart is open
+chart_window = None
+chart_panel = None
+chart_category_selector = None
+chart_openings = 0
 
-    
-# Choose the most appropriate Tk root window
-if tix and hasattr(tix, 'Tk'):
-    root = tix.Tk()
-else:
-    root = tk.Tk()
+# Chart data and rendered images, kept between plots so unchanged charts are not drawn again
+chart_cache = ChartCache()
+
+# Chart modes offered in the chart window as (label, plotting mode), least detail first
+CHART_MODES = (("Top categories", 'top'), ("Treemap", 'treemap'), ("One category", 'category'),
+               ("All categories", 'all'))
+
+# Show the expenses chart in its own window (the plotting module and matplotlib load on first use)
+def plot_detailed_expenses():
+    global chart_window, chart_panel, chart_openings, chart_category_selector
+    if chart_window is not None:
+        chart_window.deiconify()
+        chart_window.lift()
+        return
+    import plotting
+    chart_window = tk.Toplevel(root)
+    chart_window.title("Detailed Expenses")
+    chart_window.geometry("1000x650")
+    chart_window.protocol("WM_DELETE_WINDOW", close_chart)
+
+    # Mode and drill-down category; picking a category switches to its chart
+    toolbar = ttk.Frame(chart_window)
+    toolbar.pack(fill=tk.X, padx=5, pady=5)
+    ttk.Label(toolbar, text="View:").pack(side=tk.LEFT)
+    ttk.Combobox(toolbar, textvariable=chart_mode, values=[label for label, mode in CHART_MODES],
+                 state='readonly', width=16).pack(side=tk.LEFT, padx=5)
+    ttk.Label(toolbar, text="Category:").pack(side=tk.LEFT, padx=(10, 0))
+    if not chart_category.get():
+        chart_category.set(selected_category.get())
+    chart_category_selector = CategorySelector(toolbar, chart_category, ledger.find_categories, width=30)
+    chart_category_selector.pack(side=tk.LEFT, padx=5)
+    chart_category_selector.bind('<<CategorySelected>>', lambda event: chart_mode.set(CHART_MODES[2][0]))
+
+    chart_panel = plotting.ChartPanel(chart_window, cache=chart_cache)
+    chart_panel.widget.pack(fill=tk.BOTH, expand=True)
+    chart_openings += 1
+    refresh.mark('chart')
+
+# Close the chart window and stop its render thread
+def close_chart():
+    global chart_window, chart_panel, chart_category_selector
+    chart_panel.close()
+    chart_window.destroy()
+    chart_window = chart_panel = chart_category_selector = None
+
+# Hand the chart for the picked mode to the open chart window; it is drawn off the Tk thread.
+# Every mode is cut from one ChartSummary per ledger version, so switching modes aggregates nothing.
+def redraw_chart():
+    if chart_panel is None:
+        return
+    import plotting
+    mode = dict(CHART_MODES).get(chart_mode.get(), plotting.TOP)
+    category = chart_category.get() if mode == plotting.CATEGORY else None
+    if mode == plotting.CATEGORY and category not in ledger.data:
+        mode, category = plotting.TOP, None
+    summary = chart_cache.chart((ledger.version, ledger.period, 'summary'),
+                                lambda: plotting.ChartSummary(ledger.data, ledger.aggregates))
+    chart = chart_cache.chart((ledger.version, ledger.period, mode, category),
+                              lambda: summary.chart(mode, category))
+    chart_panel.show(chart)
+
+# What the chart shows; it is redrawn only when it changed or the window was opened again
+def chart_state():
+    return chart_openings, ledger.version, ledger.period, chart_mode.get(), chart_category.get()
+
+# How often the open diagnostics window shows the latest timings (ms)
+DIAGNOSTICS_POLL_MS = 1000
+
+# The diagnostics window and its widgets while it is open
+diagnostics_window = None
+
+# Show p50/p99 timings of the storage, refresh and plot operations in a window, with a
+# profiling toggle and an export for bug reports
+def show_diagnostics(event=None):
+    global diagnostics_window, diagnostics_tree, profile_btn
+    if diagnostics_window is not None:
+        diagnostics_window.deiconify()
+        diagnostics_window.lift()
+        return
+    diagnostics_window = tk.Toplevel(root)
+    diagnostics_window.title("Diagnostics")
+    diagnostics_window.geometry("640x360")
+    diagnostics_window.protocol("WM_DELETE_WINDOW", close_diagnostics)
+    columns = ('Count', 'p50 ms', 'p99 ms', 'Max ms', 'Total s')
+    diagnostics_tree = ttk.Treeview(diagnostics_window, columns=columns, height=12)
+    diagnostics_tree.heading('#0', text='Operation')
+    diagnostics_tree.column('#0', width=200)
+    for column in columns:
+        diagnostics_tree.heading(column, text=column)
+        diagnostics_tree.column(column, width=80, anchor='e')
+    diagnostics_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+    buttons = ttk.Frame(diagnostics_window)
+    buttons.pack(fill=tk.X, padx=5, pady=(0, 5))
+    profile_btn = ttk.Button(buttons, text="Start Profiling", command=toggle_profiling)
+    profile_btn.pack(side=tk.LEFT)
+    ttk.Button(buttons, text="Reset", command=instrumentation.reset).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons, text="Export Report...", command=export_diagnostics).pack(side=tk.RIGHT)
+    update_diagnostics()
+
+def close_diagnostics():
+    global diagnostics_window
+    diagnostics_window.destroy()
+    diagnostics_window = None
+
+# Show the latest timings while the diagnostics window is open
+def update_diagnostics():
+    if diagnostics_window is None:
+        return
+    diagnostics_tree.delete(*diagnostics_tree.get_children())
+    for row in instrumentation.summary():
+        diagnostics_tree.insert('', tk.END, text=row['name'], values=(
+            f"{row['count']:,}", f"{row['p50'] * 1000:.2f}", f"{row['p99'] * 1000:.2f}",
+            f"{row['max'] * 1000:.2f}", f"{row['total']:.2f}"))
+    root.after(DIAGNOSTICS_POLL_MS, update_diagnostics)
+
+# Start or stop a cProfile/tracemalloc capture; the report is shown when it stops
+def toggle_profiling():
+    if not instrumentation.profiling():
+        instrumentation.start_profiling()
+        profile_btn.config(text="Stop Profiling")
+        return
+    report = instrumentation.stop_profiling()
+    profile_btn.config(text="Start Profiling")
+    window = tk.Toplevel(root)
+    window.title("Profile")
+    text = tk.Text(window, wrap='none', width=110, height=40)
+    text.insert('1.0', report)
+    text.config(state='disabled')
+    text.pack(fill=tk.BOTH, expand=True)
+
+# Write the timings, the last profile and a description of the session to a JSON file
+def export_diagnostics():
+    path = filedialog.asksaveasfilename(
+        title="Export Diagnostics", defaultextension=".json", initialfile="expense-tracker-diagnostics.json",
+        filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+    )
+    if not path:
+        return
+    session = {
+        'storage': STORAGE_BACKEND,
+        'period': None if ledger.period is None else format_month(ledger.period),
+        'categories': len(ledger.data),
+        'expenses': sum(len(values['details']) for values in ledger.data.values()),
+        'refresh': {'redraws': refresh.redraws, 'skipped': refresh.skipped},
+        'chart_cache': {'hits': chart_cache.hits, 'disk_hits': chart_cache.disk_hits,
+                        'misses': chart_cache.misses},
+    }
+    try:
+        instrumentation.export_report(path, {'session': session})
+    except OSError as error:
+        messagebox.showerror("Export Error", f"Could not write the report: {error}")
+
+# Import the plotting module in the background once the window is up
+def prewarm_plotting():
+    threading.Thread(target=importlib.import_module, args=('plotting',), daemon=True).start()
+
+
+root = tk.Tk()
 
 root.title("Enhanced Expense Tracker")
-root.geometry("700x800")
+root.geometry("700x950")
 root.configure(bg="#2d3436")
 
 # Custom style
@@ -202,8 +655,18 @@ style.configure('TLabel', background="#2d3436", foreground="#dfe6e9")
 style.configure('TButton', background="#2a9d8f", foreground="white")
 style.configure('TEntry', background="white")
 
-# Load data
-data = load_data()
+# Changes are written to disk by a background worker
+persistence = PersistenceWorker()
+persistence.start()
+
+# The ledger holds all categories and the current month's expenses; its changes go to the
+# persistence worker. Older months are loaded when picked in the period selector.
+ledger = ExpenseLedger(sink=persistence.submit_operations, period=current_month())
+following_current_month = True
+
+# Load data: the first batch now, the rest in the background once the window is up
+deferred_changes = []
+start_loading()
 
 # Header
 header = ttk.Label(root, text="Enhanced Expense Tracker", 
@@ -213,6 +676,16 @@ header = ttk.Label(root, text="Enhanced Expense Tracker",
                    padding=10)
 header.pack(fill='x', pady=(0, 10))
 
+# Period selector
+period_frame = ttk.Frame(root)
+period_frame.pack(padx=20, fill='x')
+ttk.Label(period_frame, text="Period:").pack(side='left', padx=5)
+selected_period = tk.StringVar(root, value=format_month(ledger.period))
+period_combo = ttk.Combobox(period_frame, textvariable=selected_period, state='readonly', width=14,
+                            values=[format_month(ledger.period), ALL_HISTORY], postcommand=list_period_choices)
+period_combo.pack(side='left', padx=5)
+period_combo.bind('<<ComboboxSelected>>', select_period)
+
 # Frame for input sections
 input_frame = ttk.Frame(root, style='TFrame')
 input_frame.pack(padx=20, fill='x')
@@ -239,13 +712,12 @@ expense_label = ttk.Label(input_frame, text="Add Expense to Category", font=("He
 expense_label.grid(row=4, column=0, columnspan=2, sticky='w', pady=5)
 
 selected_category = tk.StringVar(root)
-categories = list(data.keys()) if data else ["No categories available"]
-selected_category.set(categories[0] if categories else "No categories available")
 
+# Type to filter the categories; Down opens the list
 category_dropdown_label = ttk.Label(input_frame, text="Category:")
 category_dropdown_label.grid(row=5, column=0, sticky='e', padx=5)
-category_dropdown = ttk.OptionMenu(input_frame, selected_category, *categories)
-category_dropdown.grid(row=5, column=1, sticky='w', padx=5, pady=5)
+category_selector = CategorySelector(input_frame, selected_category, ledger.find_categories, width=30)
+category_selector.grid(row=5, column=1, sticky='w', padx=5, pady=5)
 
 expense_amount_label = ttk.Label(input_frame, text="Expense Amount:")
 expense_amount_label.grid(row=6, column=0, sticky='e', padx=5)
@@ -254,14 +726,14 @@ expense_entry.grid(row=6, column=1, sticky='w', padx=5, pady=5)
 
 description_label = ttk.Label(input_frame, text="Description:")
 description_label.grid(row=7, column=0, sticky='e', padx=5)
-description_entry = ttk.Entry(input_frame, width=30)
+description_entry = AutocompleteEntry(input_frame, suggest=suggest_descriptions, on_select=fill_usual_amount, width=30)
 description_entry.grid(row=7, column=1, sticky='w', padx=5, pady=5)
 
 add_expense_btn = ttk.Button(input_frame, text="Add Expense", command=add_expense)
 add_expense_btn.grid(row=8, column=0, columnspan=2, pady=10)
 
 # Budget Status Labels
-expenses_label = ttk.Label(input_frame, text="Current Expenses: $0.00", font=("Helvetica", 12, "bold"))
+expenses_label = ttk.Label(input_frame, text=f"Expenses in {period_name(ledger.period)}: $0.00", font=("Helvetica", 12, "bold"))
 expenses_label.grid(row=9, column=0, columnspan=2, pady=5)
 
 remaining_budget_label = ttk.Label(input_frame, text="Remaining Budget: $0.00", font=("Helvetica", 12, "bold"))
@@ -271,9 +743,49 @@ remaining_budget_label.grid(row=10, column=0, columnspan=2, pady=5)
 recent_expenses_label = ttk.Label(input_frame, text="Recent Expenses", font=("Helvetica", 14))
 recent_expenses_label.grid(row=11, column=0, columnspan=2, sticky='w', pady=5)
 
+# Search and filter the expense history
+DATE_FORMAT = '%Y-%m-%d'
+DATE_HINT = "YYYY-MM-DD"
+search_query = SearchQuery()
+search_job = None
+
+search_frame = ttk.Frame(input_frame)
+search_frame.grid(row=12, column=0, columnspan=2, sticky='ew', padx=5)
+
+ttk.Label(search_frame, text="Search:").grid(row=0, column=0, sticky='e', padx=2)
+search_text_entry = ttk.Entry(search_frame, width=20)
+search_text_entry.grid(row=0, column=1, sticky='w', padx=2, pady=2)
+search_category = tk.StringVar(root, value=ALL_CATEGORIES)
+search_category_selector = CategorySelector(search_frame, search_category, ledger.find_categories,
+                                            blank=ALL_CATEGORIES, width=18)
+search_category_selector.grid(row=0, column=2, columnspan=2, sticky='w', padx=2, pady=2)
+clear_search_btn = ttk.Button(search_frame, text="Clear", command=clear_search)
+clear_search_btn.grid(row=0, column=4, padx=2, pady=2)
+
+ttk.Label(search_frame, text="Amount:").grid(row=1, column=0, sticky='e', padx=2)
+search_min_entry = ttk.Entry(search_frame, width=8)
+search_min_entry.grid(row=1, column=1, sticky='w', padx=2, pady=2)
+ttk.Label(search_frame, text="to").grid(row=1, column=1, sticky='e', padx=2)
+search_max_entry = ttk.Entry(search_frame, width=8)
+search_max_entry.grid(row=1, column=2, sticky='w', padx=2, pady=2)
+
+ttk.Label(search_frame, text=f"Dates ({DATE_HINT}):").grid(row=2, column=0, sticky='e', padx=2)
+search_from_entry = ttk.Entry(search_frame, width=11)
+search_from_entry.grid(row=2, column=1, sticky='w', padx=2, pady=2)
+ttk.Label(search_frame, text="to").grid(row=2, column=1, sticky='e', padx=2)
+search_to_entry = ttk.Entry(search_frame, width=11)
+search_to_entry.grid(row=2, column=2, sticky='w', padx=2, pady=2)
+search_status_label = ttk.Label(search_frame, text="")
+search_status_label.grid(row=2, column=3, columnspan=2, sticky='w', padx=2)
+
+for entry in (search_text_entry, search_min_entry, search_max_entry, search_from_entry, search_to_entry):
+    entry.bind('<KeyRelease>', schedule_search)
+search_category_selector.bind('<<CategorySelected>>', schedule_search)
+
 # Treeview for Recent Expenses
-recent_expenses_tree = ttk.Treeview(input_frame, columns=('Category', 'Description', 'Amount'), show='headings', height=5)
-recent_expenses_tree.grid(row=12, column=0, columnspan=2, sticky='ew', padx=5, pady=5)
+recent_expenses_tree = VirtualTreeview(input_frame, columns=('Category', 'Description', 'Amount'), height=5,
+                                       format_row=format_expense_row)
+recent_expenses_tree.grid(row=13, column=0, columnspan=2, sticky='ew', padx=5, pady=5)
 
 # Define column headings
 recent_expenses_tree.heading('Category', text='Category')
@@ -282,11 +794,61 @@ recent_expenses_tree.heading('Amount', text='Amount')
 
 # Plot Expenses Button
 plot_expenses_btn = ttk.Button(input_frame, text="Plot Detailed Expenses", command=plot_detailed_expenses)
-plot_expenses_btn.grid(row=13, column=0, columnspan=2, pady=10)
+plot_expenses_btn.grid(row=14, column=0, columnspan=2, pady=10)
+
+# Bank statement import
+statement_import = None
+import_btn = ttk.Button(input_frame, text="Import Bank Statement...", command=import_statement)
+import_btn.grid(row=15, column=0, pady=(0, 5))
+export_btn = ttk.Button(input_frame, text="Export CSV...", command=export_expenses)
+export_btn.grid(row=15, column=1, pady=(0, 5))
+import_progress = ttk.Progressbar(input_frame, mode='determinate', maximum=100, length=300)
+import_progress.grid(row=16, column=0, columnspan=2, pady=5)
+import_status_label = ttk.Label(input_frame, text="")
+import_status_label.grid(row=17, column=0, columnspan=2)
+
+# Save status
+save_status_label = ttk.Label(input_frame, text="All changes saved")
+save_status_label.grid(row=18, column=0, columnspan=2, pady=5)
+
+# Diagnostics (also on F12)
+diagnostics_btn = ttk.Button(input_frame, text="Diagnostics...", command=show_diagnostics)
+diagnostics_btn.grid(row=19, column=0, columnspan=2, pady=(0, 5))
+root.bind('<F12>', show_diagnostics)
+
+# Widget refreshes are coalesced: changes mark views dirty and each is redrawn once per idle pass
+refresh = RefreshScheduler(root)
+refresh.register('categories', refresh_categories)
+refresh.register('budget', refresh_budget_labels, state=budget_state)
+refresh.register('expenses', redraw_expenses)
+refresh.register('chart', redraw_chart, state=chart_state)
+selected_category.trace_add('write', lambda *args: refresh.mark('budget'))
+
+# Chart mode and drill-down category; they outlive the chart window, so it opens as it was left
+chart_mode = tk.StringVar(root, value=CHART_MODES[0][0])
+chart_category = tk.StringVar(root)
+chart_mode.trace_add('write', lambda *args: refresh.mark('chart'))
+chart_category.trace_add('write', lambda *args: refresh.mark('chart'))
 
 # Initialize the application with existing data
-refresh_categories()
-refresh_recent_expenses()
+refresh.mark('categories', 'budget', 'chart')
+queue_expense_refresh()
+
+# Load matplotlib shortly after the window has been drawn, so it is ready by the first plot
+root.after(0, continue_loading)
+root.after(100, prewarm_plotting)
+root.after(PERSISTENCE_POLL_MS, check_persistence)
 
 # Start the Tkinter main loop
 root.mainloop()
+
+# Flush changes still queued for disk, then let a background compaction finish before exiting
+for saved, error, external in persistence.close():
+    if error:
+        print(f"Could not save changes: {error}")
+if persistence.pending == 0 and recurring_check is None:
+    try:
+        recurring.confirm()
+    except OSError as error:
+        print(f"Could not update {recurring.path}: {error}")
+wait_for_compaction()
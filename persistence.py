@@ -0,0 +1,105 @@
+import queue
+import threading
+import time
+
+import storage
+
+# How long the worker waits for more changes before flushing a burst together (seconds)
+COALESCE_DELAY = 0.05
+
+# How long to wait before retrying a flush that failed (seconds)
+RETRY_DELAY = 1.0
+
+# How often an idle worker checks storage for changes made by other processes (seconds)
+SYNC_INTERVAL = 2.0
+
+_STOP = object()
+
+
+# Write-behind worker: the UI submits changes, a background thread appends them to storage.
+# Results, including changes other processes made, are handed back through poll(),
+# which the UI calls from the Tk thread.
+class PersistenceWorker:
+    def __init__(self):
+        self.pending = 0
+        self._changes = queue.Queue()
+        self._results = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    # Queue a list of storage operations, ('category', (category, budget)) or ('expense', (record,)),
+    # as produced by ExpenseLedger; a list is always written in one flush, however large
+    def submit_operations(self, operations):
+        operations = list(operations)
+        self.pending += len(operations)
+        self._changes.put(operations)
+
+    # Collect flush results on the Tk thread, as a list of
+    # (changes saved, error or None, changes made by other processes)
+    def poll(self):
+        results = []
+        while True:
+            try:
+                saved, error, external = self._results.get_nowait()
+            except queue.Empty:
+                return results
+            self.pending -= saved
+            results.append((saved, error, external))
+
+    # Flush everything still queued and stop the worker (call after mainloop returns)
+    def close(self):
+        self._changes.put(_STOP)
+        self._thread.join()
+        return self.poll()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                change = self._changes.get(timeout=SYNC_INTERVAL)
+            except queue.Empty:
+                self._sync()
+                continue
+            if change is _STOP:
+                break
+            batch = list(change)
+            # Coalesce the rest of a burst into the same flush
+            deadline = time.monotonic() + COALESCE_DELAY
+            while True:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    change = self._changes.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if change is _STOP:
+                    stopping = True
+                    break
+                batch.extend(change)
+            self._flush(batch, stopping)
+
+    def _flush(self, batch, stopping):
+        while True:
+            # Any backend error is reported to the UI rather than killing the worker
+            try:
+                external = storage.append_batch(batch)
+            except Exception as error:
+                self._results.put((0, error, []))
+                if stopping:
+                    return
+                time.sleep(RETRY_DELAY)
+            else:
+                self._results.put((len(batch), None, external))
+                return
+
+    def _sync(self):
+        try:
+            external = storage.sync_changes()
+        except Exception as error:
+            self._results.put((0, error, []))
+        else:
+            if external:
+                self._results.put((0, None, external))
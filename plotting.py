@@ -0,0 +1,476 @@
+import hashlib
+import threading
+
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
+
+from instrumentation import timed, timing
+from records import CENTS
+
+# Sub-expenses smaller than this share of their category are folded into one "Other" segment
+OTHER_FRACTION = 0.02
+
+# Segments shorter than this share of the tallest bar are drawn without a label
+LABEL_MIN_FRACTION = 0.03
+
+# Horizontal room (points) each category needs for its tick label, and for labels on its segments.
+# With more categories than the axis width allows, only every n-th tick is labelled and the
+# segments are not labelled at all, so the label layout stays cheap however many categories there are.
+TICK_MIN_POINTS = 12
+SEGMENT_LABEL_MIN_POINTS = 48
+
+# Width of the category total bars; sub-expense bars are half as wide
+BAR_WIDTH = 0.5
+
+# Colours of the category totals, the sub-expense segments and the folded "Other" segments
+TOTAL_COLOR = '#2a9d8f'
+SEGMENT_COLOR = '#e76f51'
+OTHER_COLOR = '#adb5bd'
+
+# Colours the treemap tiles cycle through
+TILE_COLORS = colormaps['tab20'].colors
+
+# How often the chart panel checks for a finished render (ms)
+RENDER_POLL_MS = 50
+
+# Part of every chart digest; change it when the chart's look changes so cached images are not reused
+CHART_STYLE = 2
+
+# Chart modes, from most to least detail:
+#   all        every category as a stacked bar of its sub-expenses
+#   top        the TOP_CATEGORIES biggest categories stacked, the rest as one bar
+#   treemap    one tile per category with an area proportional to its total
+#   category   drill-down: the descriptions of one category, biggest first
+ALL = 'all'
+TOP = 'top'
+TREEMAP = 'treemap'
+CATEGORY = 'category'
+MODES = (TOP, TREEMAP, CATEGORY, ALL)
+
+# Bars shown in the top mode and the drill-down, and tiles in the treemap, before the rest are folded
+TOP_CATEGORIES = 15
+TOP_DESCRIPTIONS = 25
+TREEMAP_TILES = 60
+
+# Treemap tiles smaller than this share of the chart are drawn without a label
+TILE_LABEL_MIN_AREA = 0.008
+
+# Names of the folded bars and tiles
+OTHER_CATEGORIES = "Other categories"
+OTHER_DESCRIPTIONS = "Other"
+
+
+# What one chart shows, in dollars. It is worked out from the aggregates on the Tk thread, so
+# the render thread never reads data that is still changing.
+#   kind         'bars' or 'treemap'
+#   title, xlabel
+#   categories   one name per bar or tile
+#   totals       total per bar or tile
+#   segments     (positions, bottoms, heights) of the sub-expense segments stacked on bars
+#   others       (positions, bottoms, heights) of the "Other" segments
+#   tiles        (x, y, width, height) of the treemap tiles in a unit square
+#   labels       [(x, y, text)] for the parts big enough to label
+#   folded       whether the last bar or tile holds everything not shown on its own
+class ChartData:
+    def __init__(self, kind, title, xlabel, categories, totals, segments=None, others=None, tiles=None,
+                 labels=None, folded=False):
+        self.kind = kind
+        self.title = title
+        self.xlabel = xlabel
+        self.categories = categories
+        self.totals = totals
+        self.segments = segments or (np.empty(0),) * 3
+        self.others = others or (np.empty(0),) * 3
+        self.tiles = tiles or (np.empty(0),) * 4
+        self.labels = labels if labels is not None else []
+        self.folded = folded
+        self._digest = None
+
+    # Hash of everything the chart shows, used to key rendered images
+    def digest(self):
+        if self._digest is None:
+            digest = hashlib.blake2b(repr((CHART_STYLE, self.kind, self.title, self.xlabel, self.categories,
+                                           self.labels, self.folded)).encode('utf-8'), digest_size=16)
+            for column in (self.totals, *self.segments, *self.others, *self.tiles):
+                digest.update(np.ascontiguousarray(column, dtype=float).tobytes())
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    # Height of the tallest bar or stack
+    def tallest(self):
+        tops = [self.totals, self.segments[1] + self.segments[2], self.others[1] + self.others[2]]
+        return max(top.max(initial=0.0) for top in tops)
+
+
+# The aggregation every chart mode is drawn from, worked out once per ledger version:
+# category totals and, per category, its description totals split into the segments big
+# enough to stack and the folded rest. Switching mode only selects and arranges parts of it.
+class ChartSummary:
+    @timed('plot.summary')
+    def __init__(self, data, aggregates):
+        self.categories = list(data.keys())
+        # Aggregates hold cents; the chart works in dollars
+        self.totals = np.array([aggregates.category(category).total for category in self.categories],
+                               dtype=float) / CENTS
+        # Categories biggest first (ties in category order)
+        self.order = np.argsort(-self.totals, kind='stable')
+        # Per category: description names and totals biggest first, and the stack
+        # (names kept, amounts kept, folded "Other" amount)
+        self.descriptions = []
+        self.stacks = []
+        for category in self.categories:
+            by_description = aggregates.descriptions_for(category)
+            names = list(by_description)
+            amounts = np.fromiter((stats.total for stats in by_description.values()), dtype=float,
+                                  count=len(by_description)) / CENTS
+            keep = amounts >= OTHER_FRACTION * amounts.sum()
+            self.stacks.append(([names[j] for j in np.flatnonzero(keep)], amounts[keep], amounts[~keep].sum()))
+            biggest = np.argsort(-amounts, kind='stable')
+            self.descriptions.append(([names[j] for j in biggest], amounts[biggest]))
+        self._index = {category: i for i, category in enumerate(self.categories)}
+
+    # ChartData for a mode; CATEGORY needs the category to drill into
+    @timed('plot.chart_data')
+    def chart(self, mode=TOP, category=None):
+        if mode == ALL:
+            return self._stacked(np.arange(len(self.categories)), "Detailed Expenses by Category")
+        if mode == TOP:
+            shown = self.order[:TOP_CATEGORIES]
+            if len(self.order) <= TOP_CATEGORIES:
+                return self._stacked(shown, "Detailed Expenses by Category")
+            return self._stacked(shown, f"Top {len(shown)} of {len(self.order)} Categories",
+                                 rest=self.totals[self.order[TOP_CATEGORIES:]].sum())
+        if mode == TREEMAP:
+            return self._treemap()
+        if mode == CATEGORY:
+            return self._drill_down(category)
+        raise ValueError(f"Unknown chart mode '{mode}'")
+
+    # Stacked bars for the categories at indexes, plus one bar holding rest if given
+    def _stacked(self, indexes, title, rest=None):
+        categories = [self.categories[i] for i in indexes]
+        totals = self.totals[indexes]
+        seg_positions, seg_heights, seg_bottoms, seg_names = [], [], [], []
+        other_positions, other_heights, other_bottoms = [], [], []
+        for position, i in enumerate(indexes):
+            names, kept, other = self.stacks[i]
+            tops = np.cumsum(kept)
+            seg_positions.append(np.full(len(kept), position))
+            seg_heights.append(kept)
+            seg_bottoms.append(tops - kept)
+            seg_names.extend(names)
+            if other > 0:
+                other_positions.append(position)
+                other_heights.append(other)
+                other_bottoms.append(tops[-1] if len(tops) else 0.0)
+        if rest is not None:
+            categories.append(OTHER_CATEGORIES)
+            totals = np.append(totals, rest)
+
+        segments = tuple(np.concatenate(column) if len(indexes) else np.empty(0)
+                         for column in (seg_positions, seg_bottoms, seg_heights))
+        others = tuple(np.array(column, dtype=float) for column in (other_positions, other_bottoms, other_heights))
+        chart = ChartData('bars', title, "Categories", categories, totals, segments, others,
+                          folded=rest is not None)
+
+        # Label only the segments tall enough to read
+        min_height = LABEL_MIN_FRACTION * chart.tallest()
+        positions, bottoms, heights = segments
+        for j in np.flatnonzero(heights >= min_height):
+            chart.labels.append((positions[j], bottoms[j] + heights[j] / 2, f"{seg_names[j]}\n${heights[j]:.2f}"))
+        for position, bottom, height in zip(*others):
+            if height >= min_height:
+                chart.labels.append((position, bottom + height / 2, f"Other\n${height:.2f}"))
+        if rest is not None and rest >= min_height:
+            chart.labels.append((len(categories) - 1, rest / 2, f"${rest:.2f}"))
+        return chart
+
+    # One tile per category, biggest first, the smallest folded into one tile
+    def _treemap(self):
+        shown = [i for i in self.order[:TREEMAP_TILES] if self.totals[i] > 0]
+        categories = [self.categories[i] for i in shown]
+        totals = self.totals[shown]
+        rest = self.totals[self.order[TREEMAP_TILES:]].sum()
+        if rest > 0:
+            categories.append(OTHER_CATEGORIES)
+            totals = np.append(totals, rest)
+        tiles = squarify(totals)
+        chart = ChartData('treemap', "Expenses by Category", "", categories, totals, tiles=tiles, folded=rest > 0)
+        for name, total, x, y, width, height in zip(categories, totals, *tiles):
+            if width * height >= TILE_LABEL_MIN_AREA:
+                chart.labels.append((x + width / 2, y + height / 2, f"{name}\n${total:,.2f}"))
+        return chart
+
+    # Bars for the descriptions of one category, biggest first, the smallest folded into one bar
+    def _drill_down(self, category):
+        if category not in self._index:
+            raise ValueError(f"Category '{category}' does not exist.")
+        names, amounts = self.descriptions[self._index[category]]
+        categories = names[:TOP_DESCRIPTIONS]
+        totals = amounts[:TOP_DESCRIPTIONS]
+        rest = amounts[TOP_DESCRIPTIONS:].sum()
+        if rest > 0:
+            categories = categories + [OTHER_DESCRIPTIONS]
+            totals = np.append(totals, rest)
+        chart = ChartData('bars', f"Expenses in {category}", "Descriptions", categories, totals, folded=rest > 0)
+        min_height = LABEL_MIN_FRACTION * chart.tallest()
+        for position, total in enumerate(totals):
+            if total >= min_height:
+                chart.labels.append((position, total / 2, f"${total:.2f}"))
+        return chart
+
+
+# Chart data for a mode, for callers that draw one chart and need no other modes
+def chart_data(data, aggregates, mode=TOP, category=None):
+    return ChartSummary(data, aggregates).chart(mode, category)
+
+
+# Squarified treemap layout (Bruls, Huizing and van Wijk) of values sorted biggest first in a
+# unit square: rows of tiles are laid along the shorter side while that keeps them closest to
+# square. Returns (x, y, width, height) arrays.
+def squarify(values):
+    total = float(np.sum(values))
+    tiles = np.zeros((4, len(values)))
+    if total <= 0:
+        return tuple(tiles)
+    areas = [value / total for value in values]
+    x, y, width, height = 0.0, 0.0, 1.0, 1.0
+
+    # Worst aspect ratio of a row of areas laid along a side
+    def worst(row_sum, row_min, row_max, side):
+        return max(side * side * row_max / (row_sum * row_sum), row_sum * row_sum / (side * side * row_min))
+
+    i = 0
+    while i < len(areas):
+        side = min(width, height)
+        start = i
+        row_sum = row_min = row_max = areas[i]
+        i += 1
+        while i < len(areas):
+            area = areas[i]
+            if worst(row_sum + area, min(row_min, area), max(row_max, area), side) > worst(
+                    row_sum, row_min, row_max, side):
+                break
+            row_sum, row_min, row_max = row_sum + area, min(row_min, area), max(row_max, area)
+            i += 1
+        thickness = row_sum / side
+        offset = 0.0
+        for j in range(start, i):
+            length = areas[j] / thickness
+            if width >= height:
+                tiles[:, j] = (x, y + offset, thickness, length)
+            else:
+                tiles[:, j] = (x + offset, y, length, thickness)
+            offset += length
+        if width >= height:
+            x, width = x + thickness, width - thickness
+        else:
+            y, height = y + thickness, height - thickness
+    return tuple(tiles)
+
+
+# Corners of bars centred on positions, as an (n, 4, 2) array for a PolyCollection
+def _bar_verts(positions, bottoms, heights, width):
+    left = positions - width / 2
+    right = positions + width / 2
+    tops = bottoms + heights
+    return np.stack([np.column_stack(corner) for corner in
+                     ((left, bottoms), (left, tops), (right, tops), (right, bottoms))], axis=1)
+
+
+# Corners of (x, y, width, height) rectangles, as an (n, 4, 2) array for a PolyCollection
+def _tile_verts(x, y, width, height):
+    return _bar_verts(x + width / 2, y, height, width)
+
+
+# Any chart mode on one figure. Each series is a single PolyCollection, so update() changes
+# the bars or tiles in place instead of creating an artist per bar.
+class ExpenseChart:
+    def __init__(self, figure):
+        self.figure = figure
+        self.ax = figure.add_subplot()
+        self.totals = PolyCollection(np.empty((0, 4, 2)), edgecolors='white')
+        self.segments = PolyCollection(np.empty((0, 4, 2)), facecolors=SEGMENT_COLOR, edgecolors='white',
+                                       alpha=0.7)
+        self.others = PolyCollection(np.empty((0, 4, 2)), facecolors=OTHER_COLOR, edgecolors='white', alpha=0.7)
+        self.tiles = PolyCollection(np.empty((0, 4, 2)), edgecolors='white', linewidths=1.5)
+        for collection in (self.totals, self.segments, self.others, self.tiles):
+            self.ax.add_collection(collection, autolim=False)
+        self.labels = []
+        self.ticks = None
+        self.ax.set_ylabel("Total Expenses", fontsize=12)
+        figure.set_layout_engine('tight')
+
+    def update(self, chart):
+        count = len(chart.categories)
+        positions = np.arange(count)
+        bars = chart.kind == 'bars'
+        # Room each category gets across the axis, in points
+        room = self.figure.get_figwidth() * 72 * self.ax.get_position().width / max(count, 1)
+        self.ax.set_title(chart.title, fontsize=16, fontweight='bold')
+        self.ax.set_xlabel(chart.xlabel, fontsize=12)
+        if bars:
+            self.totals.set_verts(_bar_verts(positions, np.zeros(count), chart.totals, BAR_WIDTH))
+            self.totals.set_facecolor(self._colors(count, chart.folded, [TOTAL_COLOR]))
+            self.tiles.set_verts(np.empty((0, 4, 2)))
+        else:
+            self.totals.set_verts(np.empty((0, 4, 2)))
+            self.tiles.set_verts(_tile_verts(*chart.tiles))
+            self.tiles.set_facecolor(self._colors(count, chart.folded, TILE_COLORS))
+        self.segments.set_verts(_bar_verts(*chart.segments, BAR_WIDTH / 2))
+        self.others.set_verts(_bar_verts(*chart.others, BAR_WIDTH / 2))
+        for label in self.labels:
+            label.remove()
+        shown = chart.labels if not bars or room >= SEGMENT_LABEL_MIN_POINTS else []
+        self.labels = [self.ax.text(x, y, text, ha='center', va='center', fontsize=9, color='black', clip_on=True)
+                       for x, y, text in shown]
+        if bars:
+            self.ax.set_axis_on()
+            step = max(1, int(np.ceil(TICK_MIN_POINTS / room)))
+            if (chart.categories, step) != self.ticks:
+                self.ax.set_xticks(positions[::step], chart.categories[::step], rotation=45, ha='right')
+                self.ticks = (list(chart.categories), step)
+            self.ax.set_xlim(-0.5, max(count, 1) - 0.5)
+            self.ax.set_ylim(0, (chart.tallest() or 1.0) * 1.05)
+        else:
+            # The treemap has no axes; its tiles fill the unit square
+            self.ax.set_axis_off()
+            self.ax.set_xlim(0, 1)
+            self.ax.set_ylim(0, 1)
+
+    # Face colours for count bars or tiles, grey for a last one holding everything folded
+    @staticmethod
+    def _colors(count, folded, palette):
+        colors = [palette[i % len(palette)] for i in range(count)]
+        if folded and colors:
+            colors[-1] = OTHER_COLOR
+        return colors
+
+
+# A chart of data (the chart window's default top categories unless another mode is given) on a
+# new off-screen (Agg) figure, for scripts and benchmarks
+def plot_detailed_expenses(data, aggregates, mode=TOP, category=None):
+    figure = Figure(figsize=(12, 7))
+    FigureCanvasAgg(figure)
+    ExpenseChart(figure).update(chart_data(data, aggregates, mode, category))
+    return figure
+
+
+# The chart embedded in a Tk window. The figure is drawn with Agg on a worker thread and the
+# finished image is copied into the Tk canvas from the Tk thread, so drawing a large chart never
+# blocks the UI. The figure and its artists are kept and updated for every new ChartData.
+# With a ChartCache, images already rendered for the same chart and size are shown without drawing.
+class ChartPanel:
+    def __init__(self, master, figsize=(10, 6), cache=None):
+        # Imported here so the rest of the module works without Tk (scripts, benchmarks)
+        from matplotlib.backends import _backend_tk
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        # Tk canvas that hands its drawing (after resizes) to the panel's worker
+        class WorkerCanvas(FigureCanvasTkAgg):
+            def draw(canvas):
+                self.render()
+
+            def resize(canvas, event):
+                self.render(size=(event.width, event.height))
+
+        self._blit_image = _backend_tk.blit
+        self.figure = Figure(figsize=figsize)
+        self.chart = ExpenseChart(self.figure)
+        self.canvas = WorkerCanvas(self.figure, master=master)
+        self.widget = self.canvas.get_tk_widget()
+        self.cache = cache
+        self.renders = 0
+        self._wake = threading.Condition()
+        self._chart = None
+        self._size = None
+        self._dirty = False
+        self._closed = False
+        # The latest finished image, waiting to be copied into the Tk canvas
+        self._image = None
+        # Used by the worker only: the chart on screen and the one the figure's artists show
+        self._shown = None
+        self._applied = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._poll_job = self.widget.after(RENDER_POLL_MS, self._poll)
+
+    # Draw new chart data (only the latest request is drawn if several arrive during a render)
+    def show(self, chart):
+        with self._wake:
+            self._chart = chart
+            self._dirty = True
+            self._wake.notify()
+
+    # Draw again, at a new canvas size in pixels if given
+    def render(self, size=None):
+        with self._wake:
+            if size is not None:
+                self._size = size
+            self._dirty = True
+            self._wake.notify()
+
+    def close(self):
+        with self._wake:
+            self._closed = True
+            self._wake.notify()
+        self.widget.after_cancel(self._poll_job)
+
+    def _run(self):
+        while True:
+            with self._wake:
+                while not self._dirty and not self._closed:
+                    self._wake.wait()
+                if self._closed:
+                    return
+                chart, size = self._chart, self._size
+                self._chart, self._size, self._dirty = None, None, False
+            if size is not None and size[0] > 0 and size[1] > 0:
+                dpi = self.figure.dpi
+                self.figure.set_size_inches(size[0] / dpi, size[1] / dpi, forward=False)
+                # A new width changes how many ticks and labels fit
+                self._applied = None
+            if chart is not None:
+                self._shown = chart
+            image = self._draw()
+            with self._wake:
+                self._image = image
+
+    # Image of the chart on screen at the figure's size, from the cache or drawn now
+    def _draw(self):
+        key = None
+        if self.cache is not None and self._shown is not None:
+            key = (self._shown.digest(), *self.canvas.get_width_height(physical=True))
+            image = self.cache.image(key)
+            if image is not None:
+                return image
+        with timing('plot.draw'):
+            if self._shown is not self._applied:
+                self.chart.update(self._shown)
+                self._applied = self._shown
+            FigureCanvasAgg.draw(self.canvas)
+        self.renders += 1
+        image = np.array(self.canvas.buffer_rgba())
+        if key is not None:
+            self.cache.store(key, image)
+        return image
+
+    # Copy a finished image into the Tk canvas
+    def _poll(self):
+        with self._wake:
+            image, self._image = self._image, None
+        if image is not None:
+            with timing('plot.blit'):
+                self._blit(image)
+        self._poll_job = self.widget.after(RENDER_POLL_MS, self._poll)
+
+    def _blit(self, image):
+        height, width = image.shape[:2]
+        photo = self.canvas._tkphoto
+        if (photo.width(), photo.height()) != (width, height):
+            photo.configure(width=width, height=height)
+            self.widget.coords(self.canvas._tkcanvas_image_region, width // 2, height // 2)
+        self._blit_image(photo, image, (0, 1, 2, 3))
@@ -0,0 +1,148 @@
+import datetime
+import decimal
+import time
+
+# Money is held as whole cents (int) everywhere in memory, so sums are exact. Amounts are
+# converted from text or floats when they come in (typed, loaded, imported) and back to
+# text when they go out (labels, files, charts).
+CENTS = 100
+# Largest amount, in cents, that fits the int64 columns and sums that hold it
+MAX_CENTS = 2 ** 63 - 1
+
+
+# Cents for an amount given as text ("12.30"), a float or a Decimal (dollars), or an int number
+# of dollars. Fractions of a cent are rounded half up; raises ValueError for anything else,
+# including amounts too large to store.
+def to_cents(value):
+    cents = _parse_cents(value)
+    if abs(cents) > MAX_CENTS:
+        raise ValueError(f"Amount {value!r} is too large")
+    return cents
+
+
+# Cents for an amount, without the range check of to_cents
+def _parse_cents(value):
+    if isinstance(value, int):
+        return value * CENTS
+    text = repr(value) if isinstance(value, float) else str(value).strip()
+    # Up to two decimals and 15 characters, a float holds the amount closely enough that
+    # rounding gives the exact cents; this is every stored amount, so it has to be fast
+    point = text.find('.')
+    if len(text) <= 15 and (point < 0 or len(text) - point <= 3):
+        try:
+            return round(float(text) * CENTS)
+        except (ValueError, OverflowError):
+            pass
+    try:
+        amount = decimal.Decimal(text)
+    except decimal.InvalidOperation:
+        raise ValueError(f"Invalid amount {value!r}") from None
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount {value!r}")
+    return int(amount.scaleb(2).to_integral_value(decimal.ROUND_HALF_UP))
+
+
+# Dollars as a float, for charts and for storage that keeps REAL columns
+def from_cents(cents):
+    return cents / CENTS
+
+
+# "1234.50" for an amount in cents, as stored in files and typed into entries
+def format_cents(cents):
+    whole, fraction = divmod(abs(cents), CENTS)
+    return f"{'-' if cents < 0 else ''}{whole}.{fraction:02d}"
+
+
+# "$1,234.50" (or "-$5.00") for an amount in cents, as shown in the window
+def format_money(cents):
+    whole, fraction = divmod(abs(cents), CENTS)
+    return f"{'-' if cents < 0 else ''}${whole:,}.{fraction:02d}"
+
+
+# A single logged expense, parsed once when it is loaded or added; amount is in cents
+class ExpenseRecord:
+    __slots__ = ('amount', 'description', 'timestamp', 'category')
+
+    def __init__(self, amount, description, timestamp=None, category=None):
+        self.amount = amount
+        self.description = description
+        self.timestamp = timestamp
+        self.category = category
+
+    def __repr__(self):
+        return (f"ExpenseRecord(amount={self.amount!r}, description={self.description!r}, "
+                f"timestamp={self.timestamp!r}, category={self.category!r})")
+
+    def __eq__(self, other):
+        if not isinstance(other, ExpenseRecord):
+            return NotImplemented
+        return (self.amount, self.description, self.timestamp, self.category) == \
+               (other.amount, other.description, other.timestamp, other.category)
+
+
+# Build a record for an expense being entered right now (amount as typed, in dollars)
+def new_record(category, description, amount):
+    return ExpenseRecord(to_cents(amount), description, time.time(), category)
+
+
+# Parse an old "description: amount" detail string from the legacy CSV layout
+def parse_legacy_detail(category, detail):
+    # Split on the last separator so descriptions containing ": " survive
+    description, _, amount = detail.rpartition(': ')
+    return ExpenseRecord(to_cents(amount), description, None, category)
+
+
+# Convert a stored timestamp field back to a float (empty means unknown)
+def parse_timestamp(value):
+    return float(value) if value else None
+
+
+# Format a timestamp for storage (unknown is written as an empty field)
+def format_timestamp(timestamp):
+    return '' if timestamp is None else repr(timestamp)
+
+
+# Apply a storage operation to data: ('category', (category, budget)) or ('expense', (record,))
+def apply_operation(data, kind, args):
+    if kind == 'category':
+        category, budget = args
+        if category not in data:
+            data[category] = {'budget': budget, 'expenses': 0, 'details': []}
+    elif kind == 'expense':
+        record, = args
+        values = data[record.category]
+        values['expenses'] += record.amount
+        values['details'].append(record)
+
+
+# Month (year, month) a timestamp falls in, in local time; None for an undated expense
+def month_of(timestamp):
+    if timestamp is None:
+        return None
+    date = datetime.date.fromtimestamp(timestamp)
+    return date.year, date.month
+
+
+# The month it is now
+def current_month():
+    today = datetime.date.today()
+    return today.year, today.month
+
+
+# Timestamps (start, end) of a month, with start <= timestamp < end
+def month_bounds(month):
+    year, number = month
+    start = datetime.datetime(year, number, 1)
+    end = datetime.datetime(year + number // 12, number % 12 + 1, 1)
+    return start.timestamp(), end.timestamp()
+
+
+# "2024-03" for a month, as used in file names and the UI
+def format_month(month):
+    return f"{month[0]:04d}-{month[1]:02d}"
+
+
+# Month from its "2024-03" form
+def parse_month(text):
+    year, number = text.split('-')
+    return int(year), int(number)
@@ -0,0 +1,326 @@
+import csv
+import datetime
+import heapq
+import os
+import time
+
+import storage
+from records import ExpenseRecord, format_money, month_of, to_cents
+
+# Recurring expenses (rent, subscriptions, payroll deductions): a CSV file next to the stored
+# data with a header row and one rule per row:
+#   category         existing category the postings go to
+#   description      description of every posting
+#   amount           amount in dollars
+#   schedule         when postings fall due, as a cron schedule (see CronSchedule)
+#   start            first day postings can fall due (YYYY-MM-DD); empty means when the rule is first read
+#   posted_through   written by the app: every posting due up to this time has been saved
+# Rows starting with # are ignored.
+RULES_FILE = 'recurring_rules.csv'
+FIELDS = ('category', 'description', 'amount', 'schedule', 'start', 'posted_through')
+
+# Layouts of the start and posted_through fields (local time)
+START_FORMAT = '%Y-%m-%d'
+POSTED_FORMAT = '%Y-%m-%d %H:%M'
+
+# Most postings materialized in one batch; any more are posted by the next check
+MAX_POSTINGS = 10000
+
+# How far ahead a schedule is searched for its next time (28 years covers every
+# combination of weekday and 29 February)
+MAX_SEARCH_DAYS = 366 * 28
+
+# Shorthands for common schedules
+ALIASES = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+# Allowed values of the five schedule fields
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+# Values of one schedule field: "*", "5", "1-5", "*/15", "1-31/2" or a comma list of them
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        spec, _, step = part.partition('/')
+        if spec == '*':
+            first, last = low, high
+        elif '-' in spec:
+            first, last = (int(value) for value in spec.split('-', 1))
+        else:
+            first = last = int(spec)
+        step = int(step) if step else 1
+        if not low <= first <= last <= high or step < 1:
+            raise ValueError(f"'{part}' is outside {low}-{high}")
+        values.update(range(first, last + 1, step))
+    return sorted(values)
+
+
+# A schedule in cron's five fields, "minute hour day-of-month month day-of-week" (0 or 7 is
+# Sunday), in local time, or one of ALIASES. As in cron, when both day fields are restricted a
+# day matches either of them. "0 9 1 * *" is 9:00 on the first of every month.
+class CronSchedule:
+    def __init__(self, text):
+        self.text = text.strip()
+        fields = ALIASES.get(self.text.lower(), self.text).split()
+        if len(fields) != 5:
+            raise ValueError(f"Schedule '{text}' needs five fields: minute hour day month weekday")
+        self.minutes, self.hours, days, months, weekdays = (
+            _parse_field(field, low, high) for field, (low, high) in zip(fields, FIELD_RANGES))
+        self.days = set(days)
+        self.months = set(months)
+        self.weekdays = {day % 7 for day in weekdays}
+        self._either_day = fields[2] != '*' and fields[4] != '*'
+
+    def _day_matches(self, date):
+        in_month = date.day in self.days
+        # date.weekday() counts from Monday; cron counts from Sunday
+        in_week = (date.weekday() + 1) % 7 in self.weekdays
+        return in_month or in_week if self._either_day else in_month and in_week
+
+    # First time after timestamp the schedule falls due, or None if it never does
+    def next_after(self, timestamp):
+        start = datetime.datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0) + \
+            datetime.timedelta(minutes=1)
+        date = start.date()
+        for _ in range(MAX_SEARCH_DAYS):
+            if date.month not in self.months:
+                # Skip to the first of the next month
+                date = (date.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+                continue
+            if self._day_matches(date):
+                same_day = date == start.date()
+                for hour in self.hours:
+                    if same_day and hour < start.hour:
+                        continue
+                    for minute in self.minutes:
+                        if same_day and hour == start.hour and minute < start.minute:
+                            continue
+                        return datetime.datetime.combine(date, datetime.time(hour, minute)).timestamp()
+            date += datetime.timedelta(days=1)
+        return None
+
+
+# One recurring expense; amount is in cents and posted_through a timestamp (or None)
+class RecurringRule:
+    def __init__(self, category, description, amount, schedule, start=None, posted_through=None):
+        self.category = category
+        self.description = description
+        self.amount = amount
+        self.schedule = schedule
+        self.start = start
+        self.posted_through = posted_through
+
+    # What identifies the rule in the file, however its row moves
+    def key(self):
+        return self.category, self.description, self.amount, self.schedule.text
+
+    def __repr__(self):
+        return (f"RecurringRule({self.category!r}, {self.description!r}, {format_money(self.amount)}, "
+                f"{self.schedule.text!r})")
+
+
+def _parse_time(value, layout):
+    value = value.strip()
+    return datetime.datetime.strptime(value, layout).timestamp() if value else None
+
+
+# Read the rules as ([RecurringRule], [error message per bad row]); no file means no rules
+def read_rules(path=RULES_FILE):
+    rules = []
+    errors = []
+    try:
+        with open(path, mode='r', newline='') as file:
+            for line, row in enumerate(csv.DictReader(file), start=2):
+                category = (row.get('category') or '').strip()
+                if not category or category.startswith('#'):
+                    continue
+                try:
+                    rules.append(RecurringRule(
+                        category, (row.get('description') or '').strip(), to_cents(row.get('amount') or ''),
+                        CronSchedule(row.get('schedule') or ''), _parse_time(row.get('start') or '', START_FORMAT),
+                        _parse_time(row.get('posted_through') or '', POSTED_FORMAT)))
+                except ValueError as error:
+                    errors.append(f"{path} line {line}: {error}")
+    except FileNotFoundError:
+        pass
+    return rules, errors
+
+
+# Write posted_through for the given rules into the file, leaving every other row and field as it
+# is (the file may have been edited since it was read). Written through a temporary file.
+def write_posted_through(rules, path=RULES_FILE):
+    posted = {rule.key(): rule.posted_through for rule in rules}
+    with open(path, mode='r', newline='') as file:
+        reader = csv.DictReader(file)
+        fieldnames = list(reader.fieldnames or FIELDS)
+        rows = list(reader)
+    if 'posted_through' not in fieldnames:
+        fieldnames.append('posted_through')
+    for row in rows:
+        try:
+            key = ((row.get('category') or '').strip(), (row.get('description') or '').strip(),
+                   to_cents(row.get('amount') or ''), CronSchedule(row.get('schedule') or '').text)
+        except ValueError:
+            continue
+        if posted.get(key) is not None:
+            row['posted_through'] = datetime.datetime.fromtimestamp(posted[key]).strftime(POSTED_FORMAT)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(temporary, path)
+
+
+# Next-due times of the rules in a heap, so finding what is due costs O(log n) per posting
+# however many rules there are, instead of a scan of every rule on every check
+class RecurringScheduler:
+    def __init__(self):
+        self._heap = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    # Schedule rule number index to fall due at timestamp
+    def push(self, timestamp, index):
+        heapq.heappush(self._heap, (timestamp, index))
+
+    # A separate scheduler holding the same rules
+    def copy(self):
+        scheduler = RecurringScheduler()
+        scheduler._heap = list(self._heap)
+        return scheduler
+
+    # Time the next rule falls due, or None
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    # Take the earliest (timestamp, index) if it is due at now, else None
+    def pop_due(self, now):
+        if self._heap and self._heap[0][0] <= now:
+            return heapq.heappop(self._heap)
+        return None
+
+
+# Materializes the postings of the recurring rules into a ledger, in one batch per check.
+# Postings are idempotent: each one is an expense with the rule's category, description and
+# amount, timestamped with its due time, and a posting already stored (or held by the ledger)
+# is never added again. posted_through in the rules file only saves work: it is moved on by
+# confirm() once the postings are saved, and checks start from it after a restart.
+# A check is collect() on a worker thread, then post() on the Tk thread, one check at a time;
+# confirm() is not called while a check is running.
+class RecurringPostings:
+    def __init__(self, path=RULES_FILE):
+        self.path = path
+        self.rules = []
+        self.errors = []
+        # How many of errors new_errors() has handed out
+        self._errors_reported = 0
+        self._scheduler = RecurringScheduler()
+        self._mtime = None
+        # Latest due time posted per rule key, not yet written as posted_through
+        self._unconfirmed = {}
+
+    # Read the rules again when the file changed, and schedule each from where it was posted through
+    def _reload(self, now):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        self.rules, self.errors = read_rules(self.path)
+        self._errors_reported = 0
+        self._scheduler = RecurringScheduler()
+        for index, rule in enumerate(self.rules):
+            if rule.posted_through is None and rule.start is None:
+                # A new rule without a start begins now rather than catching up on the past
+                rule.posted_through = now
+                self._unconfirmed.setdefault(rule.key(), now)
+            after = max(rule.posted_through if rule.posted_through is not None else rule.start - 1,
+                        self._unconfirmed.get(rule.key(), float('-inf')))
+            due = rule.schedule.next_after(after)
+            if due is not None:
+                self._scheduler.push(due, index)
+
+    # Take every posting due by now (time.time() by default) from the schedule, as (rule, timestamp)
+    # pairs, with the stored expenses of their months other than period as {month: records}.
+    # It reads the rules file and storage, so it runs off the Tk thread; categories are the
+    # ledger's, and rules whose category is not among them are skipped until the next start.
+    # If storage cannot be read the schedule is left as it was and the error is raised.
+    def collect(self, categories, period, now=None):
+        now = time.time() if now is None else now
+        self._reload(now)
+        scheduler = self._scheduler.copy()
+        due = []
+        while len(due) < MAX_POSTINGS:
+            item = self._scheduler.pop_due(now)
+            if item is None:
+                break
+            timestamp, index = item
+            rule = self.rules[index]
+            if rule.category not in categories:
+                self.errors.append(f"Recurring expense '{rule.description}': category '{rule.category}' "
+                                   f"does not exist")
+                continue
+            due.append((rule, timestamp))
+            following = rule.schedule.next_after(timestamp)
+            if following is not None:
+                self._scheduler.push(following, index)
+        stored = {}
+        if period is not None:
+            try:
+                for month in {month_of(timestamp) for rule, timestamp in due} - {period}:
+                    stored[month] = storage.read_expenses(month)
+            except Exception:
+                self._scheduler = scheduler
+                raise
+        return due, stored
+
+    # Add the postings from collect() that are not stored yet to ledger in one batch; returns
+    # the records added
+    def post(self, ledger, due, stored):
+        if not due:
+            return []
+        stored = {(record.category, record.description, record.amount, record.timestamp)
+                  for record in ledger.stored_expenses({month_of(timestamp) for rule, timestamp in due}, stored)}
+        records = []
+        for rule, timestamp in due:
+            key = rule.category, rule.description, rule.amount, timestamp
+            if key not in stored:
+                records.append(ExpenseRecord(rule.amount, rule.description, timestamp, rule.category))
+            self._unconfirmed[rule.key()] = max(timestamp, self._unconfirmed.get(rule.key(), timestamp))
+        if records:
+            ledger.add_expenses_bulk(records)
+        return records
+
+    # Errors added since the last call (reading the file again starts its errors afresh)
+    def new_errors(self):
+        errors = self.errors[self._errors_reported:]
+        self._errors_reported = len(self.errors)
+        return errors
+
+    # Whether posted_through has moved on since the file was last written
+    @property
+    def unconfirmed(self):
+        return bool(self._unconfirmed)
+
+    # Write posted_through for the postings made so far; call once they are saved
+    def confirm(self):
+        if not self._unconfirmed:
+            return
+        for rule in self.rules:
+            posted = self._unconfirmed.get(rule.key())
+            if posted is not None:
+                rule.posted_through = posted
+        write_posted_through(self.rules, self.path)
+        self._unconfirmed.clear()
+        self._mtime = os.stat(self.path).st_mtime
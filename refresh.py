@@ -0,0 +1,47 @@
+from instrumentation import timing
+
+
+# Coalesces widget redraws. Changes mark views dirty; every dirty view is redrawn once in a
+# single after_idle pass, however many changes arrived since the last one. A view can also
+# give a state function: when its state is the same as at the last redraw, the redraw is skipped.
+# Each redraw is timed as the operation 'refresh.<name>'.
+class RefreshScheduler:
+    def __init__(self, widget):
+        self.widget = widget
+        self._views = {}
+        self._shown = {}
+        self._dirty = set()
+        self._job = None
+        # Redraws run and skipped as unchanged, for diagnostics
+        self.redraws = 0
+        self.skipped = 0
+
+    # Add a view; views are redrawn in the order they were registered
+    def register(self, name, redraw, state=None):
+        self._views[name] = (redraw, state)
+
+    # Mark views dirty and schedule the redraw pass (once) for when Tk is idle
+    def mark(self, *names):
+        self._dirty.update(names)
+        if self._job is None:
+            self._job = self.widget.after_idle(self.flush)
+
+    # Redraw every dirty view now
+    def flush(self):
+        if self._job is not None:
+            self.widget.after_cancel(self._job)
+            self._job = None
+        dirty, self._dirty = self._dirty, set()
+        for name, (redraw, state) in self._views.items():
+            if name not in dirty:
+                continue
+            if state is not None:
+                current = state()
+                if name in self._shown and self._shown[name] == current:
+                    self.skipped += 1
+                    continue
+            with timing(f'refresh.{name}'):
+                redraw()
+            self.redraws += 1
+            if state is not None:
+                self._shown[name] = current
@@ -0,0 +1,211 @@
+import bisect
+import re
+
+# Words in a description; searches match words by prefix, ignoring case
+_TOKEN = re.compile(r'\w+')
+
+# Pending additions up to this many are inserted in place; more are merged with one sort
+_INSERT_LIMIT = 64
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+# What to look for: words (matched as prefixes of description words), a category,
+# an amount range in cents (inclusive) and a timestamp range (start <= timestamp < end).
+# None means no limit.
+class SearchQuery:
+    def __init__(self, text='', category=None, min_amount=None, max_amount=None, start=None, end=None):
+        self.tokens = tokenize(text)
+        self.category = category
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+        self.start = start
+        self.end = end
+
+    # Whether the query filters anything at all
+    def is_empty(self):
+        return not self.tokens and self.category is None and self.min_amount is None and \
+            self.max_amount is None and self.start is None and self.end is None
+
+    def matches(self, record):
+        if self.category is not None and record.category != self.category:
+            return False
+        if self.min_amount is not None and record.amount < self.min_amount:
+            return False
+        if self.max_amount is not None and record.amount > self.max_amount:
+            return False
+        if self.start is not None or self.end is not None:
+            if record.timestamp is None:
+                return False
+            if self.start is not None and record.timestamp < self.start:
+                return False
+            if self.end is not None and record.timestamp >= self.end:
+                return False
+        if self.tokens:
+            words = tokenize(record.description)
+            return all(any(word.startswith(token) for word in words) for token in self.tokens)
+        return True
+
+
+# Record ids sorted by a key (amount or timestamp), for range lookups with bisect.
+# Additions wait in a pending list until the next lookup, so loading stays cheap.
+class SortedColumn:
+    def __init__(self):
+        self.keys = []
+        self.ids = []
+        self._pending = []
+
+    def add(self, key, record_id):
+        self._pending.append((key, record_id))
+
+    def merge(self):
+        pending = self._pending
+        if not pending:
+            return
+        self._pending = []
+        if len(pending) <= _INSERT_LIMIT:
+            for key, record_id in pending:
+                position = bisect.bisect_right(self.keys, key)
+                self.keys.insert(position, key)
+                self.ids.insert(position, record_id)
+            return
+        keys = self.keys + [key for key, _ in pending]
+        ids = self.ids + [record_id for _, record_id in pending]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[i] for i in order]
+        self.ids = [ids[i] for i in order]
+
+    # Positions of the keys with low <= key (<= or <) high
+    def bounds(self, low=None, high=None, include_high=True):
+        self.merge()
+        start = 0 if low is None else bisect.bisect_left(self.keys, low)
+        if high is None:
+            end = len(self.keys)
+        elif include_high:
+            end = bisect.bisect_right(self.keys, high)
+        else:
+            end = bisect.bisect_left(self.keys, high)
+        return start, max(start, end)
+
+
+# Inverted index over expense records: description words, categories, and sorted amounts
+# and dates. Updated as records are added; a search reads the smallest matching index
+# and checks only those records against the rest of the query.
+class ExpenseIndex:
+    def __init__(self):
+        self.records = []
+        self.postings = {}
+        self.categories = {}
+        self.amounts = SortedColumn()
+        self.dates = SortedColumn()
+        self._vocabulary = []
+        self._new_words = []
+
+    def add(self, record):
+        self.add_many([record])
+
+    def add_many(self, records):
+        postings = self.postings
+        for record in records:
+            record_id = len(self.records)
+            self.records.append(record)
+            for word in set(tokenize(record.description)):
+                ids = postings.get(word)
+                if ids is None:
+                    ids = postings[word] = []
+                    self._new_words.append(word)
+                ids.append(record_id)
+            ids = self.categories.get(record.category)
+            if ids is None:
+                ids = self.categories[record.category] = []
+            ids.append(record_id)
+            self.amounts.add(record.amount, record_id)
+            if record.timestamp is not None:
+                self.dates.add(record.timestamp, record_id)
+
+    # Sort everything added so far now (after loading) rather than on the first search
+    def prepare(self):
+        self._sort_vocabulary()
+        self.amounts.merge()
+        self.dates.merge()
+
+    def _sort_vocabulary(self):
+        if len(self._new_words) > _INSERT_LIMIT:
+            self._vocabulary.extend(self._new_words)
+            self._vocabulary.sort()
+        else:
+            for word in self._new_words:
+                bisect.insort(self._vocabulary, word)
+        self._new_words = []
+
+    # Posting lists of every word starting with token
+    def _postings_for(self, token):
+        self._sort_vocabulary()
+        start = bisect.bisect_left(self._vocabulary, token)
+        end = bisect.bisect_left(self._vocabulary, token + '\U0010ffff', start)
+        return [self.postings[word] for word in self._vocabulary[start:end]]
+
+    # Records matching a SearchQuery, in the order they were added
+    def search(self, query):
+        if query.is_empty():
+            return list(self.records)
+        # (estimated size, function returning candidate ids, whether those come sorted and unique)
+        # for each index the query can use
+        sources = []
+        for token in query.tokens:
+            lists = self._postings_for(token)
+            sources.append((sum(map(len, lists)), lambda lists=lists: [i for ids in lists for i in ids],
+                            len(lists) == 1))
+        if query.category is not None:
+            ids = self.categories.get(query.category, [])
+            sources.append((len(ids), lambda: ids, True))
+        if query.min_amount is not None or query.max_amount is not None:
+            start, end = self.amounts.bounds(query.min_amount, query.max_amount)
+            sources.append((end - start, lambda: self.amounts.ids[start:end], False))
+        if query.start is not None or query.end is not None:
+            low, high = self.dates.bounds(query.start, query.end, include_high=False)
+            sources.append((high - low, lambda: self.dates.ids[low:high], False))
+        size, candidates, ordered = min(sources, key=lambda source: source[0])
+        if not size:
+            return []
+        ids = candidates() if ordered else sorted(set(candidates()))
+        records = self.records
+        return [records[i] for i in ids if query.matches(records[i])]
+
+
+# Category names in sorted order (ignoring case), for type-ahead lookups by prefix.
+# New names wait in a pending list and are merged on the next lookup, like SortedColumn.
+class CategoryIndex:
+    def __init__(self):
+        self.keys = []
+        self._pending = []
+
+    def __len__(self):
+        return len(self.keys) + len(self._pending)
+
+    def add(self, name):
+        self._pending.append((name.lower(), name))
+
+    def merge(self):
+        pending = self._pending
+        if not pending:
+            return
+        self._pending = []
+        if len(pending) <= _INSERT_LIMIT:
+            for key in pending:
+                bisect.insort(self.keys, key)
+        else:
+            self.keys.extend(pending)
+            self.keys.sort()
+
+    # Names starting with prefix (ignoring case) in sorted order, at most limit of them
+    def lookup(self, prefix='', limit=None):
+        self.merge()
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.keys, (prefix,))
+        end = bisect.bisect_left(self.keys, (prefix + '\U0010ffff',), start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return [name for _, name in self.keys[start:end]]
@@ -0,0 +1,295 @@
+import os
+import sqlite3
+import threading
+from itertools import groupby
+from operator import itemgetter
+
+import csv_storage
+from records import ExpenseRecord, apply_operation, month_bounds, parse_month, to_cents, from_cents
+
+# SQLite database holding categories and expenses. Amounts and budgets are REAL dollars
+# in the database and converted to and from cents as rows are read and written.
+DB_FILE = 'categories_expenses.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    budget REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS expenses (
+    id INTEGER PRIMARY KEY,
+    category_id INTEGER NOT NULL REFERENCES categories(id),
+    description TEXT NOT NULL,
+    amount REAL NOT NULL,
+    timestamp REAL
+);
+CREATE INDEX IF NOT EXISTS idx_expenses_category_date ON expenses(category_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(timestamp);
+"""
+
+_connection = None
+_connection_lock = threading.Lock()
+_open_lock = threading.Lock()
+
+# Several processes may share the database: the highest row ids we have seen are the
+# version stamp, and PRAGMA user_version counts full replacements by save_data()
+_last_category_id = 0
+_last_expense_id = 0
+_generation = None
+
+
+# Open the database once, creating the schema and importing the old CSV on first use
+def _connect():
+    global _connection
+    with _open_lock:
+        if _connection is None:
+            is_new = not os.path.exists(DB_FILE)
+            connection = sqlite3.connect(DB_FILE, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            connection.executescript(SCHEMA)
+            if is_new and (os.path.exists(csv_storage.CSV_FILE) or os.path.exists(csv_storage.JOURNAL_FILE)):
+                with connection:
+                    _import(connection, csv_storage.load_data())
+            _connection = connection
+        return _connection
+
+
+# Replace the database contents with data; call inside a transaction
+def _import(connection, data):
+    generation, = connection.execute("PRAGMA user_version").fetchone()
+    connection.execute("DELETE FROM expenses")
+    connection.execute("DELETE FROM categories")
+    connection.executemany(
+        "INSERT INTO categories (name, budget) VALUES (?, ?)",
+        ((category, from_cents(values['budget'])) for category, values in data.items())
+    )
+    ids = dict(connection.execute("SELECT name, id FROM categories"))
+    for category, values in data.items():
+        connection.executemany(
+            "INSERT INTO expenses (category_id, description, amount, timestamp) VALUES (?, ?, ?, ?)",
+            ((ids[category], record.description, from_cents(record.amount), record.timestamp)
+             for record in values['details'])
+        )
+    connection.execute(f"PRAGMA user_version = {generation + 1}")
+
+
+# Highest category and expense ids in the database
+def _max_ids(connection):
+    category_id, = connection.execute("SELECT COALESCE(MAX(id), 0) FROM categories").fetchone()
+    expense_id, = connection.execute("SELECT COALESCE(MAX(id), 0) FROM expenses").fetchone()
+    return category_id, expense_id
+
+
+# Rows added after the given ids, as storage operations
+def _rows_after(connection, category_id, expense_id):
+    changes = [('category', (name, to_cents(budget))) for name, budget in connection.execute(
+        "SELECT name, budget FROM categories WHERE id > ? ORDER BY id", (category_id,))]
+    changes.extend(('expense', (ExpenseRecord(to_cents(amount), description, timestamp, name),))
+                   for name, description, amount, timestamp in connection.execute(
+        "SELECT c.name, e.description, e.amount, e.timestamp "
+        "FROM expenses e JOIN categories c ON c.id = e.category_id "
+        "WHERE e.id > ? ORDER BY e.id", (expense_id,)))
+    return changes
+
+
+# Changes other processes made since we last looked; call inside a transaction
+def _sync(connection):
+    global _last_category_id, _last_expense_id, _generation
+    generation, = connection.execute("PRAGMA user_version").fetchone()
+    if generation != _generation:
+        changes = [('reload', ())]
+        _generation = generation
+    else:
+        changes = _rows_after(connection, _last_category_id, _last_expense_id)
+    _last_category_id, _last_expense_id = _max_ids(connection)
+    return changes
+
+
+# One-shot import of categories_expenses.csv (and its journal) into the database
+def import_csv():
+    save_data(csv_storage.load_data())
+
+
+# Stream stored operations as (kind, args), categories first, then expenses in id order.
+# With a period (year, month) only that month's expenses are read, through the date index.
+# Rows are read through a separate connection, so writes are not blocked while streaming.
+def stream_data(period=None):
+    global _last_category_id, _last_expense_id, _generation
+    connection = _connect()
+    with _connection_lock, connection:
+        connection.execute("BEGIN")
+        _generation, = connection.execute("PRAGMA user_version").fetchone()
+        _last_category_id, _last_expense_id = _max_ids(connection)
+        last_category_id, last_expense_id = _last_category_id, _last_expense_id
+    yield from _read_rows(last_category_id, last_expense_id, period)
+
+
+# Stream stored operations like stream_data, without changing what this process has synced
+def read_operations(period=None):
+    connection = _connect()
+    with _connection_lock:
+        last_category_id, last_expense_id = _max_ids(connection)
+    yield from _read_rows(last_category_id, last_expense_id, period)
+
+
+# Yield operations for the rows up to the given ids, on a connection of their own
+def _read_rows(last_category_id, last_expense_id, period):
+    reader = sqlite3.connect(DB_FILE)
+    try:
+        # One read transaction, so both queries see the same database state
+        reader.execute("BEGIN")
+        for name, budget in reader.execute(
+                "SELECT name, budget FROM categories WHERE id <= ? ORDER BY id", (last_category_id,)):
+            yield 'category', (name, to_cents(budget))
+        if period is None:
+            expenses = reader.execute(
+                "SELECT c.name, e.description, e.amount, e.timestamp "
+                "FROM expenses e JOIN categories c ON c.id = e.category_id "
+                "WHERE e.id <= ? ORDER BY e.id", (last_expense_id,))
+        else:
+            # Without INDEXED BY, SQLite walks the whole table in id order for the ORDER BY
+            start, end = month_bounds(period)
+            expenses = reader.execute(
+                "SELECT c.name, e.description, e.amount, e.timestamp "
+                "FROM expenses e INDEXED BY idx_expenses_date JOIN categories c ON c.id = e.category_id "
+                "WHERE e.timestamp >= ? AND e.timestamp < ? AND e.id <= ? ORDER BY e.id",
+                (start, end, last_expense_id))
+        for name, description, amount, timestamp in expenses:
+            yield 'expense', (ExpenseRecord(to_cents(amount), description, timestamp, name),)
+    finally:
+        reader.close()
+
+
+# Load data from the database (only one month's expenses if period is given)
+def load_data(period=None):
+    data = {}
+    for kind, args in stream_data(period):
+        apply_operation(data, kind, args)
+    return data
+
+
+# Expense records stored for one month, read without changing what this process has synced
+def read_expenses(period):
+    start, end = month_bounds(period)
+    connection = _connect()
+    with _connection_lock:
+        rows = connection.execute(
+            "SELECT c.name, e.description, e.amount, e.timestamp "
+            "FROM expenses e INDEXED BY idx_expenses_date JOIN categories c ON c.id = e.category_id "
+            "WHERE e.timestamp >= ? AND e.timestamp < ? ORDER BY e.id", (start, end)).fetchall()
+    return [ExpenseRecord(to_cents(amount), description, timestamp, name)
+            for name, description, amount, timestamp in rows]
+
+
+# Months (year, month) that have expenses, oldest first
+def list_periods():
+    connection = _connect()
+    with _connection_lock:
+        rows = connection.execute(
+            "SELECT DISTINCT strftime('%Y-%m', timestamp, 'unixepoch', 'localtime') "
+            "FROM expenses WHERE timestamp IS NOT NULL").fetchall()
+    return sorted(parse_month(month) for month, in rows)
+
+
+# Save data to the database, replacing what is stored.
+# Changes other processes made first are merged into data, so they are not lost.
+def save_data(data):
+    global _last_category_id, _last_expense_id, _generation
+    connection = _connect()
+    with _connection_lock, connection:
+        connection.execute("BEGIN IMMEDIATE")
+        for kind, args in _sync(connection):
+            if kind != 'reload':
+                apply_operation(data, kind, args)
+        _import(connection, data)
+        _generation += 1
+        _last_category_id, _last_expense_id = _max_ids(connection)
+
+
+# Insert a category row on an open connection
+def _insert_category(connection, category, budget):
+    connection.execute("INSERT OR IGNORE INTO categories (name, budget) VALUES (?, ?)",
+                       (category, from_cents(budget)))
+
+
+# Insert a run of expense rows on an open connection with one statement
+# (expenses for a category that does not exist are skipped)
+def _insert_expenses(connection, records):
+    category_ids = dict(connection.execute("SELECT name, id FROM categories"))
+    connection.executemany(
+        "INSERT INTO expenses (category_id, description, amount, timestamp) VALUES (?, ?, ?, ?)",
+        ((category_ids[record.category], record.description, from_cents(record.amount), record.timestamp)
+         for record in records if record.category in category_ids)
+    )
+
+
+# Insert rows in one write transaction, returning the changes other processes made first
+def _insert(operations):
+    global _last_category_id, _last_expense_id
+    connection = _connect()
+    with _connection_lock, connection:
+        connection.execute("BEGIN IMMEDIATE")
+        changes = _sync(connection)
+        # Consecutive expenses (a bulk import) go in with executemany
+        for kind, group in groupby(operations, key=itemgetter(0)):
+            if kind == 'expense':
+                _insert_expenses(connection, [args[0] for _, args in group])
+            else:
+                for _, args in group:
+                    _insert_category(connection, *args)
+        _last_category_id, _last_expense_id = _max_ids(connection)
+    return changes
+
+
+# Insert a single new category
+def append_category(category, budget):
+    return _insert([('category', (category, budget))])
+
+
+# Insert a single new expense
+def append_expense(record):
+    return _insert([('expense', (record,))])
+
+
+# Apply several operations, ('category', (category, budget)) or ('expense', (record,)), in one transaction
+def append_batch(operations):
+    return _insert(operations)
+
+
+# Changes other processes made since we last read or wrote, as operations
+# (a ('reload', ()) operation means the database was replaced and data should be loaded again)
+def sync_changes():
+    connection = _connect()
+    with _connection_lock, connection:
+        connection.execute("BEGIN")
+        return _sync(connection)
+
+
+# Category totals as (category, budget, expenses) in cents from an aggregate query;
+# each amount is rounded to whole cents before summing, so the sums are exact integers
+def category_totals():
+    connection = _connect()
+    with _connection_lock:
+        return connection.execute(
+            "SELECT c.name, CAST(ROUND(c.budget * 100) AS INTEGER), "
+            "COALESCE(SUM(CAST(ROUND(e.amount * 100) AS INTEGER)), 0) "
+            "FROM categories c LEFT JOIN expenses e ON e.category_id = c.id "
+            "GROUP BY c.id ORDER BY c.id"
+        ).fetchall()
+
+
+# SQLite checkpoints its WAL on its own, so there is nothing to compact
+def maybe_compact(data):
+    pass
+
+
+# Close the database connection (used before exit)
+def wait_for_compaction():
+    global _connection
+    with _connection_lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
@@ -0,0 +1,132 @@
+import csv
+import datetime
+import importlib
+import os
+
+from instrumentation import timed
+from records import format_cents
+
+# Storage backends by name; each module provides the same functions as csv_storage
+BACKENDS = {
+    'csv': 'csv_storage',
+    'sqlite': 'sqlite_storage',
+}
+
+# Backend used by load_data/save_data, chosen with the EXPENSE_TRACKER_STORAGE environment variable
+STORAGE_BACKEND = os.environ.get('EXPENSE_TRACKER_STORAGE', 'csv')
+
+# Date and time layout used in exported CSV files
+EXPORT_DATE_FORMAT = '%Y-%m-%d %H:%M'
+
+_backend = None
+
+
+# Switch the storage backend ('csv' or 'sqlite')
+def set_backend(name):
+    global STORAGE_BACKEND, _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{name}'")
+    STORAGE_BACKEND = name
+    _backend = None
+
+
+# The module implementing the active backend
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = importlib.import_module(BACKENDS[STORAGE_BACKEND])
+    return _backend
+
+
+# Load data from the active backend; with a period (year, month) only that month's expenses
+@timed('storage.load_data')
+def load_data(period=None):
+    return get_backend().load_data(period)
+
+
+# Stream stored operations from the active backend as (kind, args); with a period (year, month)
+# only that month's expenses (and every category)
+def stream_data(period=None):
+    return get_backend().stream_data(period)
+
+
+# Expense records stored for one month (year, month), without affecting change tracking
+@timed('storage.read_expenses')
+def read_expenses(period):
+    return get_backend().read_expenses(period)
+
+
+# Write stored expenses (one month's if period is given) to a plain CSV file with a header row,
+# for spreadsheets and other tools; whatever layout the backend keeps, this is the export format.
+# Returns the number of expenses written.
+@timed('storage.export_csv')
+def export_csv(path, period=None):
+    count = 0
+    with open(path, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Date', 'Category', 'Description', 'Amount'])
+        for kind, args in get_backend().read_operations(period):
+            if kind != 'expense':
+                continue
+            record, = args
+            date = '' if record.timestamp is None else \
+                datetime.datetime.fromtimestamp(record.timestamp).strftime(EXPORT_DATE_FORMAT)
+            writer.writerow([date, record.category, record.description, format_cents(record.amount)])
+            count += 1
+    return count
+
+
+# Months (year, month) that have expenses, oldest first
+@timed('storage.list_periods')
+def list_periods():
+    return get_backend().list_periods()
+
+
+# Save data to the active backend, replacing what is stored
+@timed('storage.save_data')
+def save_data(data):
+    get_backend().save_data(data)
+
+
+# Record a new category without rewriting stored data; returns changes made by other processes
+@timed('storage.append_category')
+def append_category(category, budget):
+    return get_backend().append_category(category, budget)
+
+
+# Record a new expense without rewriting stored data; returns changes made by other processes
+@timed('storage.append_expense')
+def append_expense(record):
+    return get_backend().append_expense(record)
+
+
+# Record several operations, ('category', (category, budget)) or ('expense', (record,)), in one write;
+# returns changes made by other processes
+@timed('storage.append_batch')
+def append_batch(operations):
+    return get_backend().append_batch(operations)
+
+
+# Changes other processes made since we last read or wrote, as operations
+# (a ('reload', ()) operation means everything was replaced and data should be loaded again)
+@timed('storage.sync_changes')
+def sync_changes():
+    return get_backend().sync_changes()
+
+
+# Category totals as (category, budget, expenses), amounts in cents
+@timed('storage.category_totals')
+def category_totals():
+    return get_backend().category_totals()
+
+
+# Let the backend compact its storage if it needs to
+@timed('storage.maybe_compact')
+def maybe_compact(data):
+    get_backend().maybe_compact(data)
+
+
+# Finish pending storage work (used before exit)
+@timed('storage.wait_for_compaction')
+def wait_for_compaction():
+    get_backend().wait_for_compaction()
@@ -0,0 +1,156 @@
+import bisect
+import heapq
+
+# Suggestions offered for a prefix
+SUGGESTION_LIMIT = 8
+
+# Recent uses count for more: a use loses half its weight every this many seconds (30 days)
+HALF_LIFE = 30 * 86400
+
+# Fixed reference time for the weights, so scores never need rescaling (2020-01-01 UTC)
+SCORE_EPOCH = 1577836800.0
+
+# Prefixes up to this length always have their best suggestions kept up to date;
+# longer ones are worked out on first use and then kept up to date too
+EAGER_PREFIX = 3
+
+
+# Weight of one use at a timestamp: 1 at SCORE_EPOCH, doubling every HALF_LIFE after it
+def use_weight(timestamp):
+    return 2.0 ** (((timestamp or SCORE_EPOCH) - SCORE_EPOCH) / HALF_LIFE)
+
+
+def _score(entry):
+    return entry.score
+
+
+# Everything known about one description within a category
+class DescriptionEntry:
+    __slots__ = ('text', 'score', 'count', 'last_used', 'amounts')
+
+    def __init__(self, text):
+        self.text = text
+        self.score = 0.0
+        self.count = 0
+        self.last_used = None
+        self.amounts = {}
+
+    def add(self, record):
+        self.score += use_weight(record.timestamp)
+        self.count += 1
+        if record.timestamp is not None and (self.last_used is None or record.timestamp >= self.last_used):
+            self.last_used = record.timestamp
+            # The most recent spelling is the one suggested
+            self.text = record.description
+        self.amounts[record.amount] = self.amounts.get(record.amount, 0) + 1
+
+    # The amount (in cents) used most often (ties go to the amount seen first)
+    def usual_amount(self):
+        return max(self.amounts.items(), key=lambda item: item[1])[0]
+
+
+# Sorted description keys of one category, with the best entries for each prefix
+class CategoryDescriptions:
+    def __init__(self):
+        self.entries = {}
+        self.keys = []
+        self._unsorted = []
+        self._top = {}
+        # Length of the longest prefix with a cached top list
+        self._longest = 0
+
+    # Add records that all share one description (compared without case)
+    def add(self, key, records):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = DescriptionEntry(records[0].description)
+            self._unsorted.append(key)
+        for record in records:
+            entry.add(record)
+        # Scores only grow, so each cached top list just has to let this entry in
+        score = entry.score
+        for length in range(1, min(len(key), max(EAGER_PREFIX, self._longest)) + 1):
+            prefix = key[:length]
+            top = self._top.get(prefix)
+            if top is None:
+                if length > EAGER_PREFIX:
+                    continue
+                top = self._top[prefix] = []
+            if len(top) >= SUGGESTION_LIMIT and top[-1] is not entry and score <= top[-1].score:
+                continue
+            if entry in top:
+                top.remove(entry)
+            # Lists are short, so a linear walk finds the slot fastest
+            position = len(top)
+            while position and top[position - 1].score < score:
+                position -= 1
+            top.insert(position, entry)
+            del top[SUGGESTION_LIMIT:]
+
+    # Best entries whose description starts with prefix
+    def lookup(self, prefix):
+        prefix = prefix.lower()
+        top = self._top.get(prefix)
+        if top is None:
+            self.sort_keys()
+            start = bisect.bisect_left(self.keys, prefix)
+            end = bisect.bisect_left(self.keys, prefix + '\U0010ffff', start)
+            matches = map(self.entries.__getitem__, self.keys[start:end])
+            top = self._top[prefix] = heapq.nlargest(SUGGESTION_LIMIT, matches, key=_score)
+            self._longest = max(self._longest, len(prefix))
+        return top
+
+    # Fold keys added since the last lookup into the sorted list
+    def sort_keys(self):
+        if not self._unsorted:
+            return
+        if len(self._unsorted) > 64:
+            self.keys.extend(self._unsorted)
+            self.keys.sort()
+        else:
+            for key in self._unsorted:
+                bisect.insort(self.keys, key)
+        self._unsorted = []
+
+
+# Description suggestions per category, ranked by how often and how recently each was used
+class DescriptionIndex:
+    def __init__(self):
+        self.categories = {}
+
+    def add(self, record):
+        self.add_many([record])
+
+    # Add a batch of records, updating each description's prefixes once however often it repeats
+    def add_many(self, records):
+        groups = {}
+        for record in records:
+            key = (record.category, record.description.lower())
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [record]
+            else:
+                group.append(record)
+        for (category, key), group in groups.items():
+            descriptions = self.categories.get(category)
+            if descriptions is None:
+                descriptions = self.categories[category] = CategoryDescriptions()
+            descriptions.add(key, group)
+
+    # Sort the keys of every category now (after loading) rather than on the first lookup
+    def sort_keys(self):
+        for descriptions in self.categories.values():
+            descriptions.sort_keys()
+
+    # Up to limit descriptions in a category starting with prefix, best first
+    def suggest(self, category, prefix, limit=SUGGESTION_LIMIT):
+        descriptions = self.categories.get(category)
+        if descriptions is None or not prefix:
+            return []
+        return [entry.text for entry in descriptions.lookup(prefix)[:limit]]
+
+    # The amount usually spent on a description in a category, or None if it is new
+    def usual_amount(self, category, description):
+        descriptions = self.categories.get(category)
+        entry = descriptions.entries.get(description.lower()) if descriptions else None
+        return entry.usual_amount() if entry else None
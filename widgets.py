@@ -0,0 +1,243 @@
+import tkinter as tk
+from tkinter import ttk
+
+
+# Treeview that only creates items for the rows currently on screen.
+# Rows are kept in a plain Python sequence and formatted on demand, so the
+# widget cost depends on its height, not on how many rows there are.
+class VirtualTreeview(ttk.Frame):
+    def __init__(self, master, columns, height=5, format_row=tuple, **kwargs):
+        super().__init__(master, **kwargs)
+        self.height = height
+        self.format_row = format_row
+        self.rows = []
+        self._offset = 0
+        self._iids = []
+
+        self.tree = ttk.Treeview(self, columns=columns, show='headings', height=height)
+        self.scrollbar = ttk.Scrollbar(self, orient='vertical', command=self._on_scroll)
+        self.tree.grid(row=0, column=0, sticky='nsew')
+        self.scrollbar.grid(row=0, column=1, sticky='ns')
+        self.columnconfigure(0, weight=1)
+
+        # Scrolling is driven by our offset, not by the Treeview itself
+        self.tree.bind('<MouseWheel>', self._on_mousewheel)
+        self.tree.bind('<Button-4>', lambda event: self.scroll(-1))
+        self.tree.bind('<Button-5>', lambda event: self.scroll(1))
+
+    def heading(self, column, **kwargs):
+        self.tree.heading(column, **kwargs)
+
+    # Replace all rows (the sequence is kept, not copied)
+    def set_rows(self, rows):
+        self.rows = rows
+        self._offset = self._max_offset()
+        self._render()
+
+    # Add rows at the end, touching only the visible items
+    def extend_rows(self, rows):
+        if not rows:
+            return
+        at_bottom = self._offset >= self._max_offset()
+        self.rows.extend(rows)
+        if at_bottom:
+            self._offset = self._max_offset()
+            self._render()
+        else:
+            self._update_scrollbar()
+
+    # Move the window by a number of rows
+    def scroll(self, rows):
+        self._set_offset(self._offset + rows)
+
+    def _max_offset(self):
+        return max(0, len(self.rows) - self.height)
+
+    def _set_offset(self, offset):
+        offset = min(max(0, offset), self._max_offset())
+        if offset != self._offset:
+            self._offset = offset
+            self._render()
+
+    def _on_scroll(self, action, amount, unit=None):
+        if action == 'moveto':
+            self._set_offset(int(float(amount) * len(self.rows)))
+        elif action == 'scroll':
+            step = self.height if unit == 'pages' else 1
+            self.scroll(int(amount) * step)
+
+    def _on_mousewheel(self, event):
+        self.scroll(-1 if event.delta > 0 else 1)
+
+    # Show rows[offset:offset + height], reusing the existing items
+    def _render(self):
+        window = self.rows[self._offset:self._offset + self.height]
+        while len(self._iids) < len(window):
+            self._iids.append(self.tree.insert('', 'end'))
+        while len(self._iids) > len(window):
+            self.tree.delete(self._iids.pop())
+        for iid, row in zip(self._iids, window):
+            self.tree.item(iid, values=self.format_row(row))
+        self._update_scrollbar()
+
+    def _update_scrollbar(self):
+        total = len(self.rows)
+        if total <= self.height:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self._offset / total, (self._offset + self.height) / total)
+
+
+# Entry that offers completions in a drop-down list while the user types.
+# suggest(text) returns the completions; on_select(text) is called when one is picked.
+# The list shows at most max_rows rows at a time and scrolls for the rest.
+class AutocompleteEntry(ttk.Entry):
+    def __init__(self, master, suggest, on_select=None, max_rows=10, **kwargs):
+        super().__init__(master, **kwargs)
+        self.suggest = suggest
+        self.on_select = on_select
+        self.max_rows = max_rows
+        self._popup = None
+        self._listbox = None
+
+        self.bind('<KeyRelease>', self._on_key)
+        self.bind('<Down>', self._focus_list)
+        self.bind('<Escape>', lambda event: self.hide())
+        self.bind('<FocusOut>', lambda event: self.after(100, self._hide_unless_focused))
+
+    # Look up completions for the current text and show or hide the list
+    def update_suggestions(self):
+        matches = self.suggest(self.get())
+        if matches:
+            self._show(matches)
+        else:
+            self.hide()
+
+    def hide(self):
+        if self._popup is not None:
+            self._popup.destroy()
+            self._popup = None
+            self._listbox = None
+
+    def _on_key(self, event):
+        if event.keysym not in ('Up', 'Down', 'Return', 'Escape', 'Tab'):
+            self.update_suggestions()
+
+    def _show(self, matches):
+        if self._popup is None:
+            self._popup = tk.Toplevel(self)
+            self._popup.overrideredirect(True)
+            self._listbox = tk.Listbox(self._popup, activestyle='dotbox', exportselection=False)
+            self._listbox.pack(fill='both', expand=True)
+            self._listbox.bind('<ButtonRelease-1>', self._choose)
+            self._listbox.bind('<Return>', self._choose)
+            self._listbox.bind('<Escape>', lambda event: (self.hide(), self.focus_set()))
+            self._listbox.bind('<FocusOut>', lambda event: self.after(100, self._hide_unless_focused))
+        self._listbox.delete(0, 'end')
+        self._listbox.insert('end', *matches)
+        self._listbox.configure(height=min(len(matches), self.max_rows))
+        self._popup.geometry(f"+{self.winfo_rootx()}+{self.winfo_rooty() + self.winfo_height()}")
+        self._popup.minsize(self.winfo_width(), 1)
+        self._popup.lift()
+
+    def _focus_list(self, event):
+        if self._listbox is not None:
+            self._listbox.focus_set()
+            self._listbox.selection_clear(0, 'end')
+            self._listbox.selection_set(0)
+            self._listbox.activate(0)
+        return 'break'
+
+    def _choose(self, event):
+        selection = self._listbox.curselection()
+        if not selection:
+            return
+        text = self._listbox.get(selection[0])
+        self.hide()
+        self.delete(0, 'end')
+        self.insert(0, text)
+        self.focus_set()
+        self.icursor('end')
+        if self.on_select:
+            self.on_select(text)
+
+    def _hide_unless_focused(self):
+        try:
+            focus = self.focus_get()
+        except KeyError:
+            focus = None
+        if focus is not self and focus is not self._listbox:
+            self.hide()
+
+
+# Searchable selector for a value from a large sorted set (categories). Typing filters the list
+# by prefix through lookup(prefix, limit), so only the matching names up to list_limit ever
+# become listbox rows; Down opens the list, Return picks the first match. The chosen name goes
+# to variable, and <<CategorySelected>> is generated. blank, if given, is offered first and
+# chosen when the text is cleared (for "all categories" filters).
+class CategorySelector(AutocompleteEntry):
+    def __init__(self, master, variable, lookup, list_limit=200, blank=None, **kwargs):
+        super().__init__(master, suggest=self._matches, on_select=self._select, **kwargs)
+        self.variable = variable
+        self.lookup = lookup
+        self.list_limit = list_limit
+        self.blank = blank
+        self._show_value()
+        variable.trace_add('write', lambda *args: self._show_value())
+
+        self.bind('<Down>', self._open_list)
+        self.bind('<Return>', self._pick_first)
+        self.bind('<FocusIn>', lambda event: self.select_range(0, 'end'))
+        self.bind('<FocusOut>', self._restore, add='+')
+
+    # Look up the list again if it is open (after categories were added)
+    def refresh(self):
+        if self._popup is not None:
+            self.update_suggestions()
+
+    def _matches(self, text):
+        if text == self.variable.get():
+            # The chosen name is in the box: list everything, not just that name
+            text = ''
+        matches = self.lookup(text, self.list_limit)
+        if self.blank is not None and not text:
+            matches = [self.blank] + matches
+        return matches
+
+    def _select(self, name):
+        self.variable.set(name)
+        self.event_generate('<<CategorySelected>>')
+
+    def _show_value(self):
+        if self.get() != self.variable.get():
+            self.delete(0, 'end')
+            self.insert(0, self.variable.get())
+
+    def _open_list(self, event):
+        if self._popup is None:
+            self.update_suggestions()
+        return self._focus_list(event)
+
+    def _pick_first(self, event):
+        text = self.get().strip()
+        if not text and self.blank is not None:
+            self._select(self.blank)
+        else:
+            matches = self.lookup(text, 1)
+            if matches:
+                self._select(matches[0])
+        self.hide()
+        self._show_value()
+        return 'break'
+
+    # Text that was typed but not picked is replaced by the current value again
+    def _restore(self, event):
+        self.after(150, self._restore_unless_focused)
+
+    def _restore_unless_focused(self):
+        try:
+            focus = self.focus_get()
+        except KeyError:
+            focus = None
+        if focus is not self and focus is not self._listbox:
+            self._show_value()